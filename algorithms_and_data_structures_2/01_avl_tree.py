@@ -1,5 +1,21 @@
+import mmap
+import pickle
+import struct
+import sys
+import threading
+from array import array
+from contextlib import contextmanager
+
 from avl_node import AVLNode
 
+# snapshot file layout (little endian): header, (size + 1) record offsets, records
+# a record is key length (u32), pickled key, pickled value; the value ends where the next record starts
+SNAPSHOT_MAGIC = b'AVLT'
+SNAPSHOT_VERSION = 1
+SNAPSHOT_HEADER = struct.Struct('<4sHHQ') # magic, version, reserved, size
+SNAPSHOT_OFFSET = struct.Struct('<Q')
+SNAPSHOT_KEY_LEN = struct.Struct('<I')
+
 
 class AVLTree:
     class NodeGroup:
@@ -12,10 +28,73 @@ class AVLTree:
             self.t2 = None
             self.t3 = None
 
-    def __init__(self):
+    # find_many falls back to one find_by_key per key below one key per this many nodes,
+    # see benchmark_find_many in test_01_avl_tree.py for the crossover (0 always falls back)
+    FIND_MANY_SPARSE_RATIO = 64
+
+    def __init__(self, verify=False):
+        """
+        :param verify: Debug mode, if True the whole tree is validated after every insert/remove (O(n) each).
+        """
         self.root = None
         self.size = 0
         self.to_restruct = None
+        self.verify = verify
+
+    @classmethod
+    def from_sorted(cls, items):
+        """Builds a perfectly balanced AVL tree from (key, value) pairs in linear time.
+        :param items: Iterable of (key, value) pairs, ideally sorted by key. Unsorted input
+        is sorted first. For duplicate keys only the first pair is kept (same as insertNode).
+        :return AVLTree containing all given pairs.
+        :raises ValueError if any key is None.
+        """
+        tree = cls()
+        pairs = tree._sorted_unique_pairs(items)
+        nodes = [tree._new_node(key, value) for key, value in pairs]
+        tree.root = tree._build_balanced(nodes, 0, len(nodes) - 1, None)
+        tree.size = len(nodes)
+        return tree
+
+    def insert_many(self, items):
+        """Inserts many (key, value) pairs at once. Keys already in the tree (or repeated
+        in items) are skipped, like in insertNode.
+        For big batches the tree is merged with the new pairs and rebuilt bottom-up in
+        O(n + m), small batches are just inserted one by one in O(m log n).
+        :param items: Iterable of (key, value) pairs, sorted or unsorted.
+        :return Number of pairs that were actually inserted.
+        :raises ValueError if any key is None.
+        """
+        pairs = self._sorted_unique_pairs(items)
+        if not pairs:
+            return 0
+
+        if len(pairs) * max(1, self.size.bit_length()) < self.size: # rebuilding would touch way more nodes than inserting
+            inserted = 0
+            for key, value in pairs:
+                if self.insertNode(key, value):
+                    inserted += 1
+            return inserted
+
+        # merge old nodes (kept as they are) with new pairs, both sorted
+        nodes = []
+        inserted = 0
+        old = self._leftmost(self.root)
+        i = 0
+        while old is not None or i < len(pairs):
+            if i == len(pairs) or (old is not None and old.key <= pairs[i][0]):
+                if i < len(pairs) and old.key == pairs[i][0]:
+                    i += 1 # key already in tree
+                nodes.append(old)
+                old = self._successor_node(old)
+            else:
+                nodes.append(self._new_node(pairs[i][0], pairs[i][1]))
+                inserted += 1
+                i += 1
+
+        self.root = self._build_balanced(nodes, 0, len(nodes) - 1, None)
+        self.size = len(nodes)
+        return inserted
 
     def getTreeRoot(self):
         """
@@ -55,6 +134,47 @@ class AVLTree:
 
         return None
 
+    def find_many(self, keys):
+        """Looks up a batch of keys. The distinct keys are sorted once and then searched with a finger: each search
+        starts from where the previous one ended and only climbs (via parent pointers) as far as needed,
+        so close keys cost O(log distance) instead of a full root-to-leaf descent.
+        :param keys: Iterable of keys to search.
+        :return List of values (None for missing keys) in the original order of keys.
+        :raises ValueError if any key is None
+        """
+        keys = list(keys)
+        if any(key is None for key in keys):
+            raise ValueError("Cannot search for null key!")
+        if len(keys) * self.FIND_MANY_SPARSE_RATIO < self.size: # sparse batch, fingers are far apart so climbing doesn't pay off
+            return [self.find_by_key(key) for key in keys]
+        try:
+            distinct = sorted(set(keys))
+        except TypeError: # unhashable keys
+            return [self.find_by_key(key) for key in keys]
+        if self.root is None:
+            return [None] * len(keys)
+
+        # results go through a dict instead of being written back by index: scattered writes into a big list cost
+        # more than the whole finger search
+        found = {}
+        finger = self.root
+        for key in distinct:
+            # climb until key lies within the subtree of finger (all keys so far were smaller)
+            while finger.parent is not None and finger.key != key:
+                p = finger.parent
+                if p.left is finger and key < p.key:
+                    break
+                finger = p
+            # normal descent, remembering the last node visited as the next finger
+            current = finger
+            while current is not None:
+                finger = current
+                if current.key == key:
+                    found[key] = current.value
+                    break
+                current = current.right if current.key < key else current.left
+        return [found.get(key) for key in keys]
+
     def insertNode(self, key, value):
         """Inserts a new node into AVL tree.
         :param key: Key of the new node.
@@ -69,7 +189,7 @@ class AVLTree:
 
         n = None # changed it so I can access the node after BST insert loop executes else I'd have to find it again or implement something more complicated for the AVL fixes
         if self.root is None:
-            n = AVLNode(key, value)
+            n = self._new_node(key, value)
             self.root = n
         else:
             current = self.root
@@ -80,20 +200,22 @@ class AVLTree:
                     if current.right is not None:
                         current = current.right
                     else:
-                        n = AVLNode(key, value)
+                        n = self._new_node(key, value)
                         self.set_right(current, n)
                         break
                 else:
                     if current.left is not None:
                         current = current.left
                     else:
-                        n = AVLNode(key, value)
+                        n = self._new_node(key, value)
                         self.set_left(current, n)
                         break
         self.size += 1
         # TODO update heights, check AVL integrity, restructure if needed
         self.update_heights(n) # updates heights from inserted node upwards, while checking balance, 
                                 # if it finds an imbalance, directly calls restructure without bothering upper nodes
+        if self.verify:
+            self.verify_tree()
         return True
 
     def removeNode(self, key):
@@ -126,13 +248,13 @@ class AVLTree:
 
                 self.size -= 1
                 # to_restruct is the node from which the search for the first unbalanced node is started
+                # update_heights walks from there up to the root and restructures every unbalanced node on the way,
+                # so only that path is touched (O(log n)) and no full-tree check is needed
                 if self.to_restruct is not None:
-                    while self.to_restruct is not None:
-                        # TODO restructure tree until it is balanced
-                        self.update_heights(self.to_restruct)
-                        balanced = self.check_balance(self.root) # dummy check, since update_heights should always work
-                        if balanced:
-                            self.to_restruct = None
+                    self.update_heights(self.to_restruct)
+                    self.to_restruct = None
+                if self.verify:
+                    self.verify_tree()
                 return True
             else:
                 parent = current
@@ -143,8 +265,296 @@ class AVLTree:
 
         return False
 
+    def rank(self, key):
+        """Returns the number of keys in the tree that are smaller than the given key, in O(log n).
+        :param key: Key to compare with, does not need to be in the tree.
+        :return Number of smaller keys (so the position key has/would have in sorted order).
+        :raises ValueError if the key is None.
+        """
+        if key is None:
+            raise ValueError("Null key is not allowed!")
+        return self._count_below(key, False)
+
+    def select(self, k):
+        """Returns the k-th smallest key (starting at 0) in O(log n), select(rank(key)) == key.
+        :param k: Position in sorted order, 0 <= k < size.
+        :return The key at position k.
+        :raises IndexError if k is out of range.
+        """
+        if k < 0 or k >= self.size:
+            raise IndexError("k out of range!")
+        current = self.root
+        while True:
+            left_size = current.left.subtree_size if current.left else 0
+            if k < left_size:
+                current = current.left
+            elif k == left_size:
+                return current.key
+            else:
+                k -= left_size + 1
+                current = current.right
+
+    def count_range(self, lo, hi):
+        """Returns the number of keys with lo <= key <= hi in O(log n).
+        :param lo: Lower bound (inclusive).
+        :param hi: Upper bound (inclusive).
+        :return Number of keys in the range, 0 if lo > hi.
+        :raises ValueError if lo or hi is None.
+        """
+        if lo is None or hi is None:
+            raise ValueError("Null bounds are not allowed!")
+        if hi < lo:
+            return 0
+        return self._count_below(hi, True) - self._count_below(lo, False)
+
+    def items(self, lo=None, hi=None, reverse=False):
+        """Lazily yields (key, value) pairs in sorted order with lo <= key <= hi.
+        Walks the parent pointers, so there is no recursion and no stack: O(log n + k) time, O(1) extra memory.
+        The tree must not be modified while iterating.
+        :param lo: Lower bound (inclusive), None for no bound.
+        :param hi: Upper bound (inclusive), None for no bound.
+        :param reverse: If True, pairs are yielded from largest to smallest key.
+        """
+        if reverse:
+            current = self._rightmost(self.root) if hi is None else self._floor_node(hi, False)
+            while current is not None and (lo is None or not current.key < lo):
+                yield current.key, current.value
+                current = self._predecessor_node(current)
+        else:
+            current = self._leftmost(self.root) if lo is None else self._ceiling_node(lo, False)
+            while current is not None and (hi is None or not hi < current.key):
+                yield current.key, current.value
+                current = self._successor_node(current)
+
+    def __iter__(self):
+        # keys in sorted order
+        for key, _ in self.items():
+            yield key
+
+    def successor(self, key):
+        """Returns the smallest key that is greater than the given key, None if there is none.
+        :raises ValueError if the key is None.
+        """
+        if key is None:
+            raise ValueError("Null key is not allowed!")
+        n = self._ceiling_node(key, True)
+        return n.key if n else None
+
+    def predecessor(self, key):
+        """Returns the largest key that is smaller than the given key, None if there is none.
+        :raises ValueError if the key is None.
+        """
+        if key is None:
+            raise ValueError("Null key is not allowed!")
+        n = self._floor_node(key, True)
+        return n.key if n else None
+
+    def floor(self, key):
+        """Returns the largest key that is smaller than or equal to the given key, None if there is none.
+        :raises ValueError if the key is None.
+        """
+        if key is None:
+            raise ValueError("Null key is not allowed!")
+        n = self._floor_node(key, False)
+        return n.key if n else None
+
+    def ceiling(self, key):
+        """Returns the smallest key that is greater than or equal to the given key, None if there is none.
+        :raises ValueError if the key is None.
+        """
+        if key is None:
+            raise ValueError("Null key is not allowed!")
+        n = self._ceiling_node(key, False)
+        return n.key if n else None
+
+    def split(self, key):
+        """Splits the tree at key in O(log n). This tree is emptied, its nodes are moved into the result.
+        :param key: Pivot key, does not need to be in the tree.
+        :return (left_tree, right_tree) with all keys < key in left_tree and all keys >= key in right_tree.
+        :raises ValueError if the key is None.
+        """
+        if key is None:
+            raise ValueError("Null key is not allowed!")
+        root = self.root
+        self.root = None
+        self.size = 0
+        left_root, right_root = self._split_nodes(root, key)
+        return self._tree_from_root(left_root), self._tree_from_root(right_root)
+
+    @classmethod
+    def join(cls, left, right):
+        """Concatenates two trees in O(log n), all keys of left must be smaller than all keys of right.
+        Both trees are emptied, their nodes are moved into the result.
+        :return AVLTree containing the keys of both trees.
+        :raises ValueError if the key ranges overlap.
+        """
+        if left.root is None or right.root is None:
+            tree = cls()
+            tree.root = left.root if left.root is not None else right.root
+            tree.size = left.size + right.size
+            left.root, left.size, right.root, right.size = None, 0, None, 0
+            return tree
+        # the smallest node of right becomes the middle node
+        middle = right._leftmost(right.root)
+        key, value = middle.key, middle.value
+        right.removeNode(key)
+        return cls.join_with(left, key, value, right)
+
+    @classmethod
+    def join_with(cls, left, key, value, right):
+        """Joins left, a new node (key, value) and right in O(log n).
+        All keys of left must be smaller than key and all keys of right greater than key.
+        Both trees are emptied, their nodes are moved into the result.
+        :return AVLTree containing the keys of both trees and the new key.
+        :raises ValueError if the key is None or the keys are not ordered.
+        """
+        if key is None:
+            raise ValueError("Null keys are not allowed!")
+        if (left.root is not None and not left._rightmost(left.root).key < key) or \
+                (right.root is not None and not key < right._leftmost(right.root).key):
+            raise ValueError("Trees to join must have ordered, non-overlapping keys!")
+
+        tree = cls()
+        tree.root = tree._join_nodes(left.root, tree._new_node(key, value), right.root)
+        tree.size = left.size + right.size + 1
+        left.root, left.size, right.root, right.size = None, 0, None, 0
+        return tree
+
+    def save(self, path):
+        """Writes the tree as a binary snapshot file (in-order records plus an offset table), see load/MappedAVLTree.
+        Keys and values are pickled, so they have to be picklable.
+        :param path: File to write.
+        """
+        offsets = array('Q')
+        with open(path, 'wb') as f:
+            f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, 0, self.size))
+            f.seek(SNAPSHOT_HEADER.size + SNAPSHOT_OFFSET.size * (self.size + 1)) # offsets are filled in at the end
+            position = 0
+            for key, value in self.items():
+                key_bytes = pickle.dumps(key, pickle.HIGHEST_PROTOCOL)
+                value_bytes = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+                offsets.append(position)
+                f.write(SNAPSHOT_KEY_LEN.pack(len(key_bytes)))
+                f.write(key_bytes)
+                f.write(value_bytes)
+                position += SNAPSHOT_KEY_LEN.size + len(key_bytes) + len(value_bytes)
+            offsets.append(position)
+            if sys.byteorder != 'little':
+                offsets.byteswap()
+            f.seek(SNAPSHOT_HEADER.size)
+            offsets.tofile(f)
+
+    @classmethod
+    def load(cls, path):
+        """Rebuilds a balanced tree from a file written by save in linear time (no insertNode calls).
+        Only load trusted files, the records are unpickled.
+        :param path: Snapshot file.
+        :return AVLTree with the saved keys and values.
+        :raises ValueError if the file is not an AVLTree snapshot.
+        """
+        with open(path, 'rb') as f:
+            data = f.read()
+        size = _read_snapshot_header(data)
+        offsets = array('Q')
+        offsets.frombytes(data[SNAPSHOT_HEADER.size:SNAPSHOT_HEADER.size + SNAPSHOT_OFFSET.size * (size + 1)])
+        if sys.byteorder != 'little':
+            offsets.byteswap()
+        base = SNAPSHOT_HEADER.size + SNAPSHOT_OFFSET.size * (size + 1)
+
+        tree = cls()
+        nodes = []
+        for i in range(size):
+            start = base + offsets[i]
+            key_len = SNAPSHOT_KEY_LEN.unpack_from(data, start)[0]
+            key_start = start + SNAPSHOT_KEY_LEN.size
+            key = pickle.loads(data[key_start:key_start + key_len])
+            value = pickle.loads(data[key_start + key_len:base + offsets[i + 1]])
+            nodes.append(tree._new_node(key, value))
+        tree.root = tree._build_balanced(nodes, 0, size - 1, None)
+        tree.size = size
+        return tree
+
     # auxiliary functions
 
+    def _tree_from_root(self, root):
+        tree = self.__class__()
+        tree.root = root
+        tree.size = root.subtree_size if root else 0
+        return tree
+
+    def _join_nodes(self, l, m, r):
+        # joins detached subtrees l < m < r and returns the new root, uses self.root as scratch since
+        # update_heights/restructure rebalance up to (and replace) the root
+        l_height = l.height if l else -1
+        r_height = r.height if r else -1
+        m.parent = None
+        if abs(l_height - r_height) <= 1:
+            self.set_left(m, l)
+            self.set_right(m, r)
+            self._update_node(m)
+            return m
+
+        # walk down the spine of the taller tree to a node with about the height of the smaller one
+        if l_height > r_height:
+            p, c = None, l
+            while c is not None and c.height > r_height + 1:
+                p, c = c, c.right
+            self.set_left(m, c)
+            self.set_right(m, r)
+            self.set_right(p, m)
+            self.root = l
+        else:
+            p, c = None, r
+            while c is not None and c.height > l_height + 1:
+                p, c = c, c.left
+            self.set_left(m, l)
+            self.set_right(m, c)
+            self.set_left(p, m)
+            self.root = r
+        self.update_heights(m) # fixes heights/sizes up the spine, at most one restructure is needed
+        root = self.root
+        self.root = None
+        return root
+
+    def _split_nodes(self, n, key):
+        # returns roots of (keys < key, keys >= key), recursion only goes down one path so depth is O(log n)
+        if n is None:
+            return None, None
+        left, right = n.left, n.right
+        for child in (left, right):
+            if child is not None:
+                child.parent = None
+        n.left = n.right = None
+        if n.key < key:
+            less, greater = self._split_nodes(right, key)
+            return self._join_nodes(left, n, less), greater
+        less, greater = self._split_nodes(left, key)
+        return less, self._join_nodes(greater, n, right)
+
+    def _new_node(self, key, value):
+        n = AVLNode(key, value)
+        n.subtree_size = 1 # AVLNode only has height, so the subtree size is added here
+        return n
+
+    def _update_node(self, n):
+        # recomputes height and subtree size of n from its children
+        left_height, left_size = (n.left.height, n.left.subtree_size) if n.left else (-1, 0)
+        right_height, right_size = (n.right.height, n.right.subtree_size) if n.right else (-1, 0)
+        n.height = 1 + max(left_height, right_height)
+        n.subtree_size = 1 + left_size + right_size
+
+    def _count_below(self, key, inclusive):
+        # number of keys < key (or <= key if inclusive), one walk down from the root
+        count = 0
+        current = self.root
+        while current is not None:
+            if current.key < key or (inclusive and current.key == key):
+                count += 1 + (current.left.subtree_size if current.left else 0)
+                current = current.right
+            else:
+                current = current.left
+        return count
+
     def _remove_bst(self, old_sub_root):
         new_sub_root = None
         if old_sub_root.left is None and old_sub_root.right is None:
@@ -176,6 +586,92 @@ class AVLTree:
 
         return new_sub_root
 
+    def _sorted_unique_pairs(self, items):
+        # returns the pairs sorted by key without duplicates (first one wins), sorts only if needed
+        pairs = []
+        is_sorted = True
+        for key, value in items:
+            if key is None:
+                raise ValueError("Null keys are not allowed!")
+            if pairs and is_sorted and not pairs[-1][0] < key:
+                is_sorted = False
+            pairs.append((key, value))
+
+        if is_sorted:
+            return pairs
+
+        pairs.sort(key=lambda pair: pair[0]) # stable, so the first of equal keys stays first
+        unique = [pairs[0]]
+        for pair in pairs[1:]:
+            if unique[-1][0] != pair[0]:
+                unique.append(pair)
+        return unique
+
+    def _build_balanced(self, nodes, lo, hi, parent):
+        # links nodes[lo..hi] (sorted) into a perfectly balanced subtree, recursion depth is only log n
+        if lo > hi:
+            return None
+        mid = (lo + hi) // 2
+        n = nodes[mid]
+        n.parent = parent
+        n.left = self._build_balanced(nodes, lo, mid - 1, n)
+        n.right = self._build_balanced(nodes, mid + 1, hi, n)
+        self._update_node(n)
+        return n
+
+    def _leftmost(self, n):
+        if n is None:
+            return None
+        while n.left is not None:
+            n = n.left
+        return n
+
+    def _rightmost(self, n):
+        if n is None:
+            return None
+        while n.right is not None:
+            n = n.right
+        return n
+
+    def _predecessor_node(self, n):
+        if n.left is not None:
+            return self._rightmost(n.left)
+        while n.parent is not None and n.parent.left is n:
+            n = n.parent
+        return n.parent
+
+    def _ceiling_node(self, key, strict):
+        # node with the smallest key >= key (> key if strict)
+        best = None
+        current = self.root
+        while current is not None:
+            if current.key > key or (not strict and current.key == key):
+                best = current
+                current = current.left
+            else:
+                current = current.right
+        return best
+
+    def _floor_node(self, key, strict):
+        # node with the largest key <= key (< key if strict)
+        best = None
+        current = self.root
+        while current is not None:
+            if current.key < key or (not strict and current.key == key):
+                best = current
+                current = current.right
+            else:
+                current = current.left
+        return best
+
+    def _successor_node(self, n):
+        # next node in order, using parent pointers instead of a stack
+        if n.right is not None:
+            return self._leftmost(n.right)
+        while n.parent is not None and n.parent.right is n:
+            n = n.parent
+        return n.parent
+
     def set_left(self, parent, child):
         parent.left = child
         if child is not None:
@@ -194,6 +690,7 @@ class AVLTree:
             right_height = current.right.height if current.right else -1
 
             current.height = 1 + max(left_height, right_height)
+            current.subtree_size = 1 + (current.left.subtree_size if current.left else 0) + (current.right.subtree_size if current.right else 0)
             balance = abs(left_height - right_height)
             
             if balance > 1: 
@@ -211,7 +708,10 @@ class AVLTree:
         
         y_left_height = y.left.height if y.left else -1
         y_right_height =y.right.height if y.right else -1
-        x = y.left if y_left_height > y_right_height else y.right
+        if y_left_height != y_right_height:
+            x = y.left if y_left_height > y_right_height else y.right
+        else: # only happens after deletions, x has to be on the same side as y (single rotation) or b stays unbalanced
+            x = y.left if y is z.left else y.right
         
         nodes = [x,y,z]
         sorted_nodes = sorted(nodes, key=lambda x: x.key) # can just sort normally since it's inorder 
@@ -258,19 +758,45 @@ class AVLTree:
         else:
             self.root = b
 
-        # FIX HEIGHTS
-        a_left_height = a.left.height if a.left else -1
-        a_right_height = a.right.height if a.right else -1
-        a.height = 1 + max(a_left_height, a_right_height)
-
-        c_left_height = c.left.height if c.left else -1
-        c_right_height = c.right.height if c.right else -1
-        c.height = 1 + max(c_left_height, c_right_height)
-
-        b.height = 1 + max(b.left.height, b.right.height)
+        # FIX HEIGHTS (and subtree sizes)
+        self._update_node(a)
+        self._update_node(c)
+        self._update_node(b)
 
         return b
 
+    def verify_tree(self):
+        """Checks the whole tree (order, parent pointers, heights and balance) without recursion.
+        Only meant for debugging, costs O(n).
+        :raises ValueError if the tree is broken.
+        """
+        if self.root is not None and self.root.parent is not None:
+            raise ValueError("Root must not have a parent!")
+        count = 0
+        prev = None
+        current = self._leftmost(self.root)
+        while current is not None:
+            count += 1
+            if prev is not None and not prev.key < current.key:
+                raise ValueError(f"Keys out of order at {current.key}!")
+            for child in (current.left, current.right):
+                if child is not None and child.parent is not current:
+                    raise ValueError(f"Wrong parent pointer at {child.key}!")
+            left_height = current.left.height if current.left else -1
+            right_height = current.right.height if current.right else -1
+            if current.height != 1 + max(left_height, right_height):
+                raise ValueError(f"Wrong height at {current.key}!")
+            left_size = current.left.subtree_size if current.left else 0
+            right_size = current.right.subtree_size if current.right else 0
+            if current.subtree_size != 1 + left_size + right_size:
+                raise ValueError(f"Wrong subtree size at {current.key}!")
+            if abs(left_height - right_height) > 1:
+                raise ValueError(f"Unbalanced node {current.key}!")
+            prev = current
+            current = self._successor_node(current)
+        if count != self.size:
+            raise ValueError("Size does not match number of nodes!")
+
     def check_balance(self, current):
         # https://www.geeksforgeeks.org/how-to-determine-if-a-binary-tree-is-balanced/ 
         # used this
@@ -287,3 +813,567 @@ class AVLTree:
             return True  
 
 
+def _read_snapshot_header(data):
+    if len(data) < SNAPSHOT_HEADER.size:
+        raise ValueError("Not an AVLTree snapshot!")
+    magic, version, _, size = SNAPSHOT_HEADER.unpack_from(data, 0)
+    if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+        raise ValueError("Not an AVLTree snapshot!")
+    base = SNAPSHOT_HEADER.size + SNAPSHOT_OFFSET.size * (size + 1)
+    if len(data) < base or len(data) < base + SNAPSHOT_OFFSET.unpack_from(data, base - SNAPSHOT_OFFSET.size)[0]:
+        raise ValueError("Snapshot file is truncated!") # the last offset is where the records end
+    return size
+
+
+class MappedAVLTree:
+    """Read-only view of a snapshot written by AVLTree.save. The file is memory-mapped and searched with binary search
+    over the offset table, so opening it is O(1) and only the pages a lookup touches are read.
+    Only open trusted files, keys and values are unpickled on access.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.size = _read_snapshot_header(self.map)
+        except (ValueError, OSError):
+            self.file.close()
+            raise
+        self.base = SNAPSHOT_HEADER.size + SNAPSHOT_OFFSET.size * (self.size + 1)
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def getSize(self):
+        return self.size
+
+    def find_by_key(self, key):
+        """Returns value of the given key, None if it is not in the snapshot. O(log n) key reads.
+        :raises ValueError if the key is None
+        """
+        if key is None:
+            raise ValueError("Cannot search for null key!")
+        i = self._lower_bound(key)
+        if i < self.size and self._key_at(i) == key:
+            return self._value_at(i)
+        return None
+
+    def items(self, lo=None, hi=None):
+        """Lazily yields (key, value) pairs with lo <= key <= hi in sorted order."""
+        i = 0 if lo is None else self._lower_bound(lo)
+        while i < self.size:
+            key = self._key_at(i)
+            if hi is not None and hi < key:
+                return
+            yield key, self._value_at(i)
+            i += 1
+
+    # auxiliary functions
+
+    def _offset(self, i):
+        return self.base + SNAPSHOT_OFFSET.unpack_from(self.map, SNAPSHOT_HEADER.size + SNAPSHOT_OFFSET.size * i)[0]
+
+    def _key_at(self, i):
+        start = self._offset(i)
+        key_len = SNAPSHOT_KEY_LEN.unpack_from(self.map, start)[0]
+        start += SNAPSHOT_KEY_LEN.size
+        return pickle.loads(self.map[start:start + key_len])
+
+    def _value_at(self, i):
+        start = self._offset(i)
+        key_len = SNAPSHOT_KEY_LEN.unpack_from(self.map, start)[0]
+        return pickle.loads(self.map[start + SNAPSHOT_KEY_LEN.size + key_len:self._offset(i + 1)])
+
+    def _lower_bound(self, key):
+        # first index with key_at(i) >= key
+        lo, hi = 0, self.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key_at(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+
+class ArrayAVLTree:
+    """AVL tree that stores its nodes in preallocated parallel arrays instead of AVLNode objects.
+    A node is just an index, left/right/parent are int32 indices (-1 = no node) and heights are single bytes,
+    so a node costs roughly 29 bytes (two list slots + 13 bytes of arrays) instead of a whole object with a __dict__.
+    Same public API as AVLTree for insertNode, removeNode, find_by_key, getSize and getTreeHeight.
+    """
+    NIL = -1
+
+    def __init__(self, capacity=16):
+        """
+        :param capacity: Number of node slots allocated up front, the arrays double when they are full.
+        """
+        capacity = max(1, capacity)
+        self.keys = [None] * capacity
+        self.values = [None] * capacity
+        self.left = array('i', [self.NIL]) * capacity
+        self.right = array('i', [self.NIL]) * capacity
+        self.parent = array('i', [self.NIL]) * capacity
+        self.height = array('b', [0]) * capacity
+        self.capacity = capacity
+        self.root = self.NIL
+        self.size = 0
+        self.used = 0 # slots [0, used) have been handed out at least once
+        self.free = self.NIL # removed slots, chained through self.left
+
+    def getTreeRoot(self):
+        """:return index of the root node, -1 for an empty tree."""
+        return self.root
+
+    def getTreeHeight(self):
+        """:return -1 in case of empty tree, current tree height otherwise."""
+        return -1 if self.size == 0 else self.height[self.root]
+
+    def getSize(self):
+        """:return Number of key/value pairs."""
+        return self.size
+
+    def get_memory_usage(self):
+        """Returns the number of bytes used by the node arrays (without the key/value objects themselves)."""
+        return (sys.getsizeof(self.keys) + sys.getsizeof(self.values) + sys.getsizeof(self.left)
+                + sys.getsizeof(self.right) + sys.getsizeof(self.parent) + sys.getsizeof(self.height))
+
+    def find_by_key(self, key):
+        """Returns value of node with given key.
+        :param key: Key to search.
+        :return Corresponding value if key was found, None otherwise.
+        :raises ValueError if the key is None
+        """
+        if key is None:
+            raise ValueError("Cannot search for null key!")
+        i = self._find(key)
+        return self.values[i] if i != self.NIL else None
+
+    def insertNode(self, key, value):
+        """Inserts a new node into the tree.
+        :param key: Key of the new node.
+        :param value: Data of the new node.
+        :return True if the insert was successful, False if the key already exists.
+        :raises ValueError if the key is None.
+        """
+        if key is None:
+            raise ValueError("Null keys are not allowed!")
+
+        keys, left, right = self.keys, self.left, self.right
+        parent = self.NIL
+        current = self.root
+        while current != self.NIL:
+            k = keys[current]
+            if k == key:
+                return False
+            parent = current
+            current = right[current] if k < key else left[current]
+
+        n = self._allocate(key, value) # may grow the arrays, so don't use the local references after this
+        self.parent[n] = parent
+        if parent == self.NIL:
+            self.root = n
+        elif self.keys[parent] < key:
+            self.right[parent] = n
+        else:
+            self.left[parent] = n
+        self.size += 1
+        self._rebalance(parent)
+        return True
+
+    def removeNode(self, key):
+        """Removes node with given key.
+        :param key: Key of node to remove.
+        :return True If node was found and deleted, False otherwise.
+        @raises ValueError if the key is None.
+        """
+        if key is None:
+            raise ValueError("Null key is not allowed!")
+        n = self._find(key)
+        if n == self.NIL:
+            return False
+
+        left, right = self.left, self.right
+        if left[n] != self.NIL and right[n] != self.NIL:
+            # move the predecessor's entry into n and unlink the predecessor slot instead
+            pred = left[n]
+            while right[pred] != self.NIL:
+                pred = right[pred]
+            self.keys[n] = self.keys[pred]
+            self.values[n] = self.values[pred]
+            n = pred
+
+        child = left[n] if left[n] != self.NIL else right[n]
+        p = self.parent[n]
+        if child != self.NIL:
+            self.parent[child] = p
+        self._replace_child(p, n, child)
+        self._release(n)
+        self.size -= 1
+        self._rebalance(p)
+        return True
+
+    # auxiliary functions
+
+    def _find(self, key):
+        keys, left, right = self.keys, self.left, self.right
+        current = self.root
+        while current != self.NIL:
+            k = keys[current]
+            if k == key:
+                return current
+            current = right[current] if k < key else left[current]
+        return self.NIL
+
+    def _allocate(self, key, value):
+        if self.free != self.NIL:
+            n = self.free
+            self.free = self.left[n]
+        else:
+            if self.used == self.capacity:
+                self._grow()
+            n = self.used
+            self.used += 1
+        self.keys[n] = key
+        self.values[n] = value
+        self.left[n] = self.NIL
+        self.right[n] = self.NIL
+        self.height[n] = 0
+        return n
+
+    def _release(self, n):
+        self.keys[n] = None # don't keep removed keys/values alive
+        self.values[n] = None
+        self.parent[n] = self.NIL
+        self.right[n] = self.NIL
+        self.left[n] = self.free
+        self.free = n
+
+    def _grow(self):
+        # doubling keeps appends amortized O(1)
+        extra = self.capacity
+        self.keys.extend([None] * extra)
+        self.values.extend([None] * extra)
+        self.left.extend(array('i', [self.NIL]) * extra)
+        self.right.extend(array('i', [self.NIL]) * extra)
+        self.parent.extend(array('i', [self.NIL]) * extra)
+        self.height.extend(array('b', [0]) * extra)
+        self.capacity += extra
+
+    def _h(self, n):
+        return self.height[n] if n != self.NIL else -1
+
+    def _fix_height(self, n):
+        self.height[n] = 1 + max(self._h(self.left[n]), self._h(self.right[n]))
+
+    def _replace_child(self, p, old, new):
+        if p == self.NIL:
+            self.root = new
+        elif self.left[p] == old:
+            self.left[p] = new
+        else:
+            self.right[p] = new
+
+    def _rotate_left(self, z):
+        y = self.right[z]
+        t1 = self.left[y]
+        p = self.parent[z]
+        self.right[z] = t1
+        if t1 != self.NIL:
+            self.parent[t1] = z
+        self.left[y] = z
+        self.parent[z] = y
+        self.parent[y] = p
+        self._replace_child(p, z, y)
+        self._fix_height(z)
+        self._fix_height(y)
+        return y
+
+    def _rotate_right(self, z):
+        y = self.left[z]
+        t2 = self.right[y]
+        p = self.parent[z]
+        self.left[z] = t2
+        if t2 != self.NIL:
+            self.parent[t2] = z
+        self.right[y] = z
+        self.parent[z] = y
+        self.parent[y] = p
+        self._replace_child(p, z, y)
+        self._fix_height(z)
+        self._fix_height(y)
+        return y
+
+    def _rebalance(self, n):
+        # same idea as AVLTree.update_heights: fix heights from n up to the root, rotate where needed
+        while n != self.NIL:
+            l, r = self.left[n], self.right[n]
+            balance = self._h(l) - self._h(r)
+            if balance > 1:
+                if self._h(self.left[l]) < self._h(self.right[l]): # double rotation
+                    self._rotate_left(l)
+                n = self._rotate_right(n)
+            elif balance < -1:
+                if self._h(self.right[r]) < self._h(self.left[r]):
+                    self._rotate_right(r)
+                n = self._rotate_left(n)
+            else:
+                self._fix_height(n)
+            n = self.parent[n]
+
+
+class PersistentAVLNode:
+    """Immutable node of a PersistentAVLTree, never changed after construction (no parent pointer)."""
+    __slots__ = ('key', 'value', 'left', 'right', 'height', 'subtree_size')
+
+    def __init__(self, key, value, left=None, right=None):
+        self.key = key
+        self.value = value
+        self.left = left
+        self.right = right
+        self.height = 1 + max(left.height if left else -1, right.height if right else -1)
+        self.subtree_size = 1 + (left.subtree_size if left else 0) + (right.subtree_size if right else 0)
+
+
+class PersistentAVLTree:
+    """Copy-on-write AVL tree: an update copies only the O(log n) nodes on the path to the changed key
+    and then swaps self.root, all other nodes are shared with older versions.
+    snapshot() is O(1) and gives readers a version that never changes, no matter what the writer does later,
+    so readers need no locks. Updates are meant to come from a single writer thread.
+    """
+
+    def __init__(self, root=None):
+        self.root = root
+
+    def snapshot(self):
+        """Returns the current version in O(1). Updating the snapshot creates a new branch and never affects this tree."""
+        return PersistentAVLTree(self.root)
+
+    def getTreeRoot(self):
+        return self.root
+
+    def getTreeHeight(self):
+        """:return -1 in case of empty tree, current tree height otherwise."""
+        return -1 if self.root is None else self.root.height
+
+    def getSize(self):
+        """:return Number of key/value pairs."""
+        return self.root.subtree_size if self.root else 0
+
+    def find_by_key(self, key):
+        """Returns value of node with given key.
+        :param key: Key to search.
+        :return Corresponding value if key was found, None otherwise.
+        :raises ValueError if the key is None
+        """
+        if key is None:
+            raise ValueError("Cannot search for null key!")
+        current = self.root
+        while current is not None:
+            if current.key == key:
+                return current.value
+            current = current.right if current.key < key else current.left
+        return None
+
+    def insertNode(self, key, value):
+        """Inserts a new node, creating a new version of the tree.
+        :return True if the insert was successful, False if the key already exists.
+        :raises ValueError if the key is None.
+        """
+        if key is None:
+            raise ValueError("Null keys are not allowed!")
+        new_root = self._insert(self.root, key, value)
+        if new_root is self.root:
+            return False
+        self.root = new_root # single assignment, readers see either the old or the new version
+        return True
+
+    def removeNode(self, key):
+        """Removes node with given key, creating a new version of the tree.
+        :return True If node was found and deleted, False otherwise.
+        @raises ValueError if the key is None.
+        """
+        if key is None:
+            raise ValueError("Null key is not allowed!")
+        new_root = self._remove(self.root, key)
+        if new_root is self.root:
+            return False
+        self.root = new_root
+        return True
+
+    def items(self, lo=None, hi=None):
+        """Lazily yields (key, value) pairs with lo <= key <= hi in sorted order.
+        There are no parent pointers here, so this keeps a stack of O(log n) nodes.
+        """
+        stack = []
+        current = self.root
+        while stack or current is not None:
+            if current is not None:
+                if lo is not None and current.key < lo:
+                    current = current.right # whole left subtree is out of range
+                else:
+                    stack.append(current)
+                    current = current.left
+            else:
+                current = stack.pop()
+                if hi is not None and hi < current.key:
+                    return
+                yield current.key, current.value
+                current = current.right
+
+    # auxiliary functions
+
+    def _insert(self, n, key, value):
+        # returns the new subtree root, or n itself if key already exists (nothing copied then)
+        if n is None:
+            return PersistentAVLNode(key, value)
+        if n.key == key:
+            return n
+        if n.key < key:
+            right = self._insert(n.right, key, value)
+            return n if right is n.right else self._balance(n.key, n.value, n.left, right)
+        left = self._insert(n.left, key, value)
+        return n if left is n.left else self._balance(n.key, n.value, left, n.right)
+
+    def _remove(self, n, key):
+        # returns the new subtree root, or n itself if key was not found
+        if n is None:
+            return None
+        if n.key < key:
+            right = self._remove(n.right, key)
+            return n if right is n.right else self._balance(n.key, n.value, n.left, right)
+        if key < n.key:
+            left = self._remove(n.left, key)
+            return n if left is n.left else self._balance(n.key, n.value, left, n.right)
+        if n.left is None:
+            return n.right
+        if n.right is None:
+            return n.left
+        successor = n.right
+        while successor.left is not None:
+            successor = successor.left
+        return self._balance(successor.key, successor.value, n.left, self._remove(n.right, successor.key))
+
+    def _balance(self, key, value, left, right):
+        # builds a new node from key/value and children, rotating (with new nodes) if it would be unbalanced
+        left_height = left.height if left else -1
+        right_height = right.height if right else -1
+        if left_height > right_height + 1:
+            if self._height(left.left) >= self._height(left.right): # single rotation
+                return PersistentAVLNode(left.key, left.value, left.left, PersistentAVLNode(key, value, left.right, right))
+            lr = left.right # double rotation
+            return PersistentAVLNode(lr.key, lr.value, PersistentAVLNode(left.key, left.value, left.left, lr.left),
+                                     PersistentAVLNode(key, value, lr.right, right))
+        if right_height > left_height + 1:
+            if self._height(right.right) >= self._height(right.left):
+                return PersistentAVLNode(right.key, right.value, PersistentAVLNode(key, value, left, right.left), right.right)
+            rl = right.left
+            return PersistentAVLNode(rl.key, rl.value, PersistentAVLNode(key, value, left, rl.left),
+                                     PersistentAVLNode(right.key, right.value, rl.right, right.right))
+        return PersistentAVLNode(key, value, left, right)
+
+    def _height(self, n):
+        return n.height if n else -1
+
+
+class ReadWriteLock:
+    """Many readers or one writer at a time. Waiting writers block new readers, so writers don't starve.
+    Not reentrant.
+    """
+
+    def __init__(self):
+        self.cond = threading.Condition(threading.Lock())
+        self.readers = 0
+        self.writer = False
+        self.waiting_writers = 0
+
+    @contextmanager
+    def read_locked(self):
+        with self.cond:
+            while self.writer or self.waiting_writers > 0:
+                self.cond.wait()
+            self.readers += 1
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.readers -= 1
+                if self.readers == 0:
+                    self.cond.notify_all()
+
+    @contextmanager
+    def write_locked(self):
+        with self.cond:
+            self.waiting_writers += 1
+            while self.writer or self.readers > 0:
+                self.cond.wait()
+            self.waiting_writers -= 1
+            self.writer = True
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.writer = False
+                self.cond.notify_all()
+
+
+class ConcurrentAVLTree:
+    """Thread-safe wrapper around AVLTree. Lookups and range scans share a read lock and run in parallel,
+    updates (including the shared to_restruct state of AVLTree) run under the write lock.
+    apply_batch takes the write lock once for a whole batch of inserts and removes.
+    """
+
+    def __init__(self, tree=None):
+        self.tree = tree if tree is not None else AVLTree()
+        self.lock = ReadWriteLock()
+
+    def getSize(self):
+        with self.lock.read_locked():
+            return self.tree.getSize()
+
+    def getTreeHeight(self):
+        with self.lock.read_locked():
+            return self.tree.getTreeHeight()
+
+    def find_by_key(self, key):
+        """Same as AVLTree.find_by_key, can run in parallel with other readers."""
+        with self.lock.read_locked():
+            return self.tree.find_by_key(key)
+
+    def items(self, lo=None, hi=None, reverse=False):
+        """Returns the (key, value) pairs with lo <= key <= hi as a list.
+        The scan is done under the read lock, it is not lazy so the lock isn't held while the caller consumes it.
+        """
+        with self.lock.read_locked():
+            return list(self.tree.items(lo, hi, reverse))
+
+    def insertNode(self, key, value):
+        with self.lock.write_locked():
+            return self.tree.insertNode(key, value)
+
+    def removeNode(self, key):
+        with self.lock.write_locked():
+            return self.tree.removeNode(key)
+
+    def apply_batch(self, inserts=(), removes=()):
+        """Applies a batch of updates while holding the write lock once. Inserts are done first (via insert_many),
+        then removes, readers see either none or all of the batch.
+        :param inserts: Iterable of (key, value) pairs.
+        :param removes: Iterable of keys.
+        :return (number of inserted pairs, number of removed keys)
+        :raises ValueError if any key is None (the batch may then be partially applied).
+        """
+        with self.lock.write_locked():
+            inserted = self.tree.insert_many(inserts)
+            removed = 0
+            for key in removes:
+                if self.tree.removeNode(key):
+                    removed += 1
+            return inserted, removed
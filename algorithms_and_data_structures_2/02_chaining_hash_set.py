@@ -1,25 +1,103 @@
+import hashlib
+import mmap
+import operator
+import os
+import struct
+import threading
+from functools import partial
+
 from chaining_hash_node import ChainingHashNode
 
+try:
+    import numpy as np
+except ImportError: # only needed for NumpyIntHashSet
+    np = None
+
+DEFAULT_CAPACITY = 8
+FIBONACCI_MULTIPLIER = 11400714819323198485 # 2^64 / golden ratio, odd
+MASK_64 = (1 << 64) - 1
+
+
+def fibonacci_hash(key, seed=0):
+    """Default hash function: multiplicative (Fibonacci) hashing of hash(key), so keys sharing factors with the
+    capacity (e.g. strided ids) still spread over all buckets.
+    The product's well mixed high bits are folded into the low bits, since the table index is taken from the low bits.
+    :param key: Any hashable key.
+    :param seed: Changes the hash function, e.g. to make collisions hard to provoke on purpose.
+    :return: 64 bit hash code.
+    """
+    h = ((hash(key) ^ seed) * FIBONACCI_MULTIPLIER) & MASK_64
+    return h ^ (h >> 29)
+
+
+def modulo_hash(key):
+    """Hash of the course's layout, where int key k is in bucket k % capacity (hash() would move -1 to -2).
+    Tables installed with set_hash_table are looked up with it, unless a hash_function was given.
+    """
+    return key if isinstance(key, int) else hash(key)
+
+
+def _chain_keys(node):
+    while node:
+        yield node.key
+        node = node.next
+
+
 class ChainingHashSet():
-    def __init__(self, capacity=0):
+    def __init__(self, capacity=0, max_load_factor=1.0, min_load_factor=0.25, rehash_step=4, hash_function=None, seed=0,
+                 collect_stats=False):
+        """
+        :param capacity: Initial number of buckets (rounded up to a power of two), DEFAULT_CAPACITY if it is 0.
+                         The table never shrinks below it.
+        :param max_load_factor: The table doubles once table_size / capacity goes above this.
+        :param min_load_factor: The table halves once table_size / capacity goes below this (0 = never shrink).
+        :param rehash_step: Number of old buckets moved to the new table per insert/contains/remove while resizing.
+        :param hash_function: Callable key -> int, its low bits pick the bucket. Default is fibonacci_hash with the given seed
+                              (modulo_hash once a table is set with set_hash_table).
+        :param seed: Seed of the default hash function.
+        :param collect_stats: If True, probes (chain nodes looked at) are counted per insert/contains/remove, see get_stats.
+        :raises ValueError if the options don't make sense (shrinking right after growing or the other way around).
+        """
+        if capacity <= 0:
+            capacity = DEFAULT_CAPACITY
+        if max_load_factor <= 0 or min_load_factor < 0 or min_load_factor * 2 >= max_load_factor or rehash_step < 1:
+            raise ValueError("Invalid resize options!")
+        capacity = 1 << (capacity - 1).bit_length() # power of two, so the index is just a bit mask
+        self.hash_function = hash_function if hash_function is not None else partial(fibonacci_hash, seed=seed)
+        self.default_hash = hash_function is None
         self.hash_table = [None] * capacity
         self.table_size = 0
         self.capacity = capacity
+        self.initial_capacity = capacity
+        self.max_load_factor = max_load_factor
+        self.min_load_factor = min_load_factor
+        self.rehash_step = rehash_step
+        # while resizing, buckets of old_table with index >= rehash_index still have to be moved to hash_table
+        self.old_table = None
+        self.old_capacity = 0
+        self.rehash_index = 0
+        self.probe_counts = None
+        self.operation_counts = None
+        if collect_stats:
+            self.reset_stats()
 
     def get_hash_code(self, key):
-        """Hash function that calculates a hash code for a given key using the modulo division.
+        """Hash function that calculates a hash code for a given key by masking the output of hash_function
+        (modulo division if the table was set to a size which is not a power of two, e.g. key % capacity
+        for int keys of a table from set_hash_table).
         :param key:
         		Key for which a hash code shall be calculated according to the length of the hash table.
         :return:
         		The calculated hash code for the given key.
 
         """
-        return key%(self.capacity)
+        return self._index(key, self.capacity)
 
     def get_hash_table(self):
         """(Required for testing only)
         :return the hash table.
         """
+        self._finish_rehash()
         return self.hash_table
 
     def set_hash_table(self, table):
@@ -32,8 +110,12 @@ class ChainingHashSet():
         !!!
 
         """
+        self.old_table = None # a running resize is dropped together with the old table
+        if self.default_hash: # the given table is laid out as key % len(table)
+            self.hash_function = modulo_hash
         self.hash_table = table
         self.capacity = len(table)
+        self.initial_capacity = len(table) # don't shrink below the given table
         self.table_size = 0
         for node in table:
             while node is not None:
@@ -44,6 +126,10 @@ class ChainingHashSet():
         """returns the number of stored keys (keys must be unique!)."""
         return self.table_size
 
+    def get_load_factor(self):
+        """returns table_size / capacity."""
+        return self.table_size / self.capacity
+
     def insert(self, key):
         """Inserts a key and returns True if it was successful. If there is already an entry with the
           same key, the new key will not be inserted and False is returned.
@@ -56,23 +142,39 @@ class ChainingHashSet():
          """
         if key is None:
             raise ValueError
-        
-        if self.contains(key):
-            return False
-        else:
-            hash_k = self.get_hash_code(key)
-            node = ChainingHashNode(key)
+        self._rehash_step()
 
-            if self.hash_table[hash_k] is None:
-                self.hash_table[hash_k] = node
-            else:
-                current = self.hash_table[hash_k]
-                while current.next:
-                    current = current.next
-                current.next = node
+        # single pass: look for the key and remember the tail of the chain at the same time
+        hash_k = self.get_hash_code(key)
+        probes = 0
+        tail = None
+        current = self.hash_table[hash_k]
+        while current:
+            probes += 1
+            if current.key == key:
+                self._record('insert', probes)
+                return False
+            tail = current
+            current = current.next
+        if self.old_table is not None:
+            current = self.old_table[self._index(key, self.old_capacity)]
+            while current:
+                probes += 1
+                if current.key == key:
+                    self._record('insert', probes)
+                    return False
+                current = current.next
 
-            self.table_size+=1
-            return True
+        node = ChainingHashNode(key)
+        if tail is None:
+            self.hash_table[hash_k] = node
+        else:
+            tail.next = node
+
+        self.table_size+=1
+        self._record('insert', probes)
+        self._check_load()
+        return True
 
     def contains(self, key):
         """Searches for a given key in the hash table.
@@ -85,14 +187,28 @@ class ChainingHashSet():
          """
         if key is None:
             raise ValueError
+        self._rehash_step()
         
         hash_k = self.get_hash_code(key)
+        probes = 0
         current = self.hash_table[hash_k]
         while current:
+            probes += 1
             if current.key == key:
+                self._record('contains', probes)
                 return True
             else:
                 current = current.next
+
+        if self.old_table is not None: # not moved yet?
+            current = self.old_table[self._index(key, self.old_capacity)]
+            while current:
+                probes += 1
+                if current.key == key:
+                    self._record('contains', probes)
+                    return True
+                current = current.next
+        self._record('contains', probes)
         return False
 
     def remove(self, key):
@@ -106,48 +222,961 @@ class ChainingHashSet():
         """
         if key is None:
             raise ValueError
+        self._rehash_step()
 
-        hash_k = self.get_hash_code(key)
+        removed, probes = self._remove_from(self.hash_table, self.get_hash_code(key), key)
+        if not removed and self.old_table is not None:
+            removed, old_probes = self._remove_from(self.old_table, self._index(key, self.old_capacity), key)
+            probes += old_probes
+        self._record('remove', probes)
+        if removed:
+            self.table_size -= 1
+            self._check_load()
+        return removed
+
+    def clear(self):
+        """Removes all stored elements from the hash table by setting all nodes to None.
+        """
+        self.old_table = None
+        self.hash_table = [None] * self.capacity
+        self.table_size = 0
+
+    def to_string(self):
+        """Returns a string representation of the hash table (array indices and stored keys) in the format
+            Idx_0 {Node, Node, ... }, Idx_1 {...}
+            e.g. for a 10 bucket table from set_hash_table after inserting 13, 82, 92, 12, 2, 32:
+            0 {}, 1 {}, 2 {82, 92, 12, 2, 32}, 3 {13}, 4 {}, 5 {}, 6 {}, 7 {}, 8 {}, 9 {}
+            (a set created with the default fibonacci_hash spreads the keys differently)."""
+        self._finish_rehash()
+        # join instead of repeated +=, which copies the whole string every time
+        return ', '.join(str(i) + ' {' + ', '.join(str(key) for key in _chain_keys(self.hash_table[i])) + '}'
+                         for i in range(len(self.hash_table)))
+
+    def __iter__(self):
+        """Lazily yields all stored keys (bucket by bucket), no big string or list is built.
+        The set must not be modified while iterating."""
+        self._finish_rehash() # otherwise lookups during the iteration move old buckets behind the iterator
+        for node in self.hash_table:
+            yield from _chain_keys(node)
+
+    def get_stats(self):
+        """Returns health statistics of the table. The chain lengths are computed on demand in O(capacity),
+        the probe counts are only collected if the set was created with collect_stats=True (None otherwise).
+        :return: dict with table_size, capacity, load_factor, max_chain_length, mean_chain_length (over non-empty buckets),
+                 chain_length_histogram ({length: number of buckets}), probes and operations ({'insert': ..., 'contains': ..., 'remove': ...})
+                 and mean_probes per operation.
+        """
+        histogram = {}
+        for table in (self.hash_table, self.old_table):
+            for node in table or ():
+                length = 0
+                while node:
+                    length += 1
+                    node = node.next
+                histogram[length] = histogram.get(length, 0) + 1
+        non_empty = sum(count for length, count in histogram.items() if length > 0)
+        mean_probes = None
+        if self.probe_counts is not None:
+            mean_probes = {op: (self.probe_counts[op] / n if n else 0.0) for op, n in self.operation_counts.items()}
+        return {
+            'table_size': self.table_size,
+            'capacity': self.capacity,
+            'load_factor': self.get_load_factor(),
+            'max_chain_length': max(histogram, default=0),
+            'mean_chain_length': self.table_size / non_empty if non_empty else 0.0,
+            'chain_length_histogram': dict(sorted(histogram.items())),
+            'probes': None if self.probe_counts is None else dict(self.probe_counts),
+            'operations': None if self.operation_counts is None else dict(self.operation_counts),
+            'mean_probes': mean_probes,
+        }
+
+    def reset_stats(self):
+        """Sets all probe/operation counters to 0 (and turns collecting them on)."""
+        self.probe_counts = {'insert': 0, 'contains': 0, 'remove': 0}
+        self.operation_counts = {'insert': 0, 'contains': 0, 'remove': 0}
+
+    # set algebra: if both tables have the same capacity and hash function, key k is in bucket i of both,
+    # so chains are compared bucket by bucket; otherwise the smaller set probes the larger one.
+    # All of them take another ChainingHashSet and are O(len(self) + len(other)) at most.
+
+    def copy(self):
+        """Returns a new set with the same keys, options and table layout."""
+        self._finish_rehash()
+        result = self._new_like(self.capacity)
+        for i, node in enumerate(self.hash_table):
+            tail = None
+            while node:
+                copied = ChainingHashNode(node.key)
+                if tail is None:
+                    result.hash_table[i] = copied
+                else:
+                    tail.next = copied
+                tail = copied
+                node = node.next
+        result.table_size = self.table_size
+        return result
+
+    def union(self, other):
+        """Returns a new set with all keys of self and other, pre-sized for both."""
+        self._finish_rehash()
+        other._finish_rehash()
+        result = self._new_like(self._capacity_for(self.table_size + other.table_size))
+        result._add_all(self)
+        result._add_all(other)
+        return result
+
+    def intersection(self, other):
+        """Returns a new set with the keys that are in self and in other."""
+        self._finish_rehash()
+        other._finish_rehash()
+        same = self._same_hashing(other)
+        small, large = (self, other) if self.table_size <= other.table_size else (other, self)
+        result = self._new_like(self.capacity if same else self._capacity_for(small.table_size))
+        for i, node in enumerate(small.hash_table):
+            while node:
+                key = node.key
+                if large._chain_has(i if same else large.get_hash_code(key), key):
+                    result._prepend(i if same else result.get_hash_code(key), key) # keys of small are unique
+                node = node.next
+        result._check_load()
+        return result
+
+    def difference(self, other):
+        """Returns a new set with the keys of self that are not in other."""
+        self._finish_rehash()
+        other._finish_rehash()
+        same = self._same_hashing(other)
+        if not same and other.table_size < self.table_size:
+            result = self.copy() # other is smaller, so it probes the copy instead
+            for key in other:
+                result._discard(key)
+            result._check_load()
+            return result
+        result = self._new_like(self.capacity if same else self._capacity_for(self.table_size))
+        for i, node in enumerate(self.hash_table):
+            while node:
+                key = node.key
+                if not other._chain_has(i if same else other.get_hash_code(key), key):
+                    result._prepend(i if same else result.get_hash_code(key), key)
+                node = node.next
+        result._check_load()
+        return result
+
+    def issubset(self, other):
+        """Returns True if every key of self is also in other."""
+        if self.table_size > other.table_size:
+            return False
+        self._finish_rehash()
+        other._finish_rehash()
+        same = self._same_hashing(other)
+        for i, node in enumerate(self.hash_table):
+            while node:
+                if not other._chain_has(i if same else other.get_hash_code(node.key), node.key):
+                    return False
+                node = node.next
+        return True
+
+    def update(self, other):
+        """In-place union, the table is grown to its final size once up front instead of step by step."""
+        self._finish_rehash()
+        other._finish_rehash()
+        capacity = self._capacity_for(self.table_size + other.table_size)
+        if capacity != self.capacity:
+            self._start_rehash(capacity)
+            self._finish_rehash()
+        self._add_all(other)
+
+    def intersection_update(self, other):
+        """In-place intersection."""
+        self._finish_rehash()
+        other._finish_rehash()
+        same = self._same_hashing(other)
+        self._filter_chains(lambda i, key: other._chain_has(i if same else other.get_hash_code(key), key))
+        self._check_load()
+
+    def difference_update(self, other):
+        """In-place difference."""
+        self._finish_rehash()
+        other._finish_rehash()
+        same = self._same_hashing(other)
+        if not same and other.table_size < self.table_size:
+            for key in other:
+                self._discard(key)
+        else:
+            self._filter_chains(lambda i, key: not other._chain_has(i if same else other.get_hash_code(key), key))
+        self._check_load()
+
+    # auxiliary functions
+
+    def _index(self, key, capacity):
+        h = self.hash_function(key)
+        if capacity & (capacity - 1) == 0:
+            return h & (capacity - 1)
+        return h % capacity
+
+    def _remove_from(self, table, hash_k, key):
+        # returns (removed?, number of probes)
+        probes = 0
         prev = None
-        current = self.hash_table[hash_k]
+        current = table[hash_k]
         while current:
+            probes += 1
             if current.key == key:
                 if prev:
                     prev.next = current.next
                 else:
-                    self.hash_table[hash_k] = current.next
-                self.table_size -= 1
+                    table[hash_k] = current.next
+                return True, probes
+            else:
+                prev = current
+                current = current.next
+        return False, probes
+
+    def _new_like(self, capacity):
+        # empty set with the same options and hash function and exactly the given capacity, the constructor would
+        # round it up to a power of two (a table from set_hash_table may have any size)
+        result = ChainingHashSet(capacity, self.max_load_factor, self.min_load_factor, self.rehash_step, self.hash_function)
+        if result.capacity != capacity:
+            result.hash_table = [None] * capacity
+            result.capacity = capacity
+        result.initial_capacity = min(capacity, self.initial_capacity) # may still shrink like self
+        return result
+
+    def _capacity_for(self, size):
+        capacity = self.capacity
+        while size > self.max_load_factor * capacity:
+            capacity *= 2
+        return capacity
+
+    def _same_hashing(self, other):
+        # True if every key has the same bucket index in both tables
+        if self.capacity != other.capacity:
+            return False
+        f, g = self.hash_function, other.hash_function
+        if f is g:
+            return True
+        return isinstance(f, partial) and isinstance(g, partial) and f.func is g.func and f.args == g.args \
+            and f.keywords == g.keywords
+
+    def _chain_has(self, hash_k, key):
+        # lookup without rehash steps or stats, only valid while no resize is running
+        current = self.hash_table[hash_k]
+        while current:
+            if current.key == key:
                 return True
+            current = current.next
+        return False
+
+    def _prepend(self, hash_k, key):
+        # adds a key that is known to be new
+        node = ChainingHashNode(key)
+        node.next = self.hash_table[hash_k]
+        self.hash_table[hash_k] = node
+        self.table_size += 1
+
+    def _add_all(self, source):
+        # inserts all keys of source, self must be big enough already (no resize running)
+        same = self._same_hashing(source)
+        for i, node in enumerate(source.hash_table):
+            while node:
+                hash_k = i if same else self.get_hash_code(node.key)
+                if not self._chain_has(hash_k, node.key):
+                    self._prepend(hash_k, node.key)
+                node = node.next
+
+    def _discard(self, key):
+        removed, _ = self._remove_from(self.hash_table, self.get_hash_code(key), key)
+        if removed:
+            self.table_size -= 1
+
+    def _filter_chains(self, keep):
+        # unlinks every node for which keep(bucket index, key) is False
+        for i in range(len(self.hash_table)):
+            prev = None
+            current = self.hash_table[i]
+            while current:
+                if keep(i, current.key):
+                    prev = current
+                elif prev:
+                    prev.next = current.next
+                    self.table_size -= 1
+                else:
+                    self.hash_table[i] = current.next
+                    self.table_size -= 1
+                current = current.next
+
+    def _record(self, operation, probes):
+        if self.probe_counts is not None:
+            self.probe_counts[operation] += probes
+            self.operation_counts[operation] += 1
+
+    def _check_load(self):
+        # starts a resize if the load factor left [min_load_factor, max_load_factor], the actual moving is done by _rehash_step
+        if self.table_size > self.max_load_factor * self.capacity:
+            self._start_rehash(self.capacity * 2)
+        elif self.table_size < self.min_load_factor * self.capacity and self.capacity > self.initial_capacity:
+            self._start_rehash(max(self.initial_capacity, self.capacity // 2))
+
+    def _start_rehash(self, new_capacity):
+        self._finish_rehash() # only one resize at a time, rarely needed since a resize is done long before the next one
+        self.old_table = self.hash_table
+        self.old_capacity = self.capacity
+        self.rehash_index = 0
+        self.hash_table = [None] * new_capacity
+        self.capacity = new_capacity
+
+    def _rehash_step(self, buckets=None):
+        # moves a few buckets from old_table to hash_table, so no single operation pays for the whole rehash
+        if self.old_table is None:
+            return
+        end = min(self.old_capacity, self.rehash_index + (buckets or self.rehash_step))
+        for i in range(self.rehash_index, end):
+            current = self.old_table[i]
+            while current:
+                next_node = current.next
+                hash_k = self.get_hash_code(current.key)
+                current.next = self.hash_table[hash_k] # prepend, the order inside a chain doesn't matter
+                self.hash_table[hash_k] = current
+                current = next_node
+            self.old_table[i] = None
+        self.rehash_index = end
+        if end == self.old_capacity:
+            self.old_table = None
+
+    def _finish_rehash(self):
+        if self.old_table is not None:
+            self._rehash_step(self.old_capacity)
+
+
+class StripedChainingHashSet():
+    """Thread-safe chaining hash set with lock striping: bucket i is guarded by lock i % stripes, so threads working
+    on different stripes don't block each other. Every stripe also counts its own keys, the size is the sum of the
+    counters, so there is no shared counter all writers have to update.
+    Growing takes all locks and rehashes at once (incremental rehashing like in ChainingHashSet would need the same
+    cross-table locking on every operation), it doesn't shrink.
+    """
+
+    def __init__(self, capacity=0, stripes=16, max_load_factor=1.0, hash_function=None, seed=0):
+        """
+        :param capacity: Initial number of buckets, rounded up to a power of two and at least stripes.
+        :param stripes: Number of locks, rounded up to a power of two.
+        :param max_load_factor: The table doubles once a stripe holds more than its share of max_load_factor * capacity.
+        :param hash_function: Callable key -> int, default is fibonacci_hash with the given seed.
+        :param seed: Seed of the default hash function.
+        :raises ValueError if stripes or max_load_factor are not positive.
+        """
+        if stripes < 1 or max_load_factor <= 0:
+            raise ValueError("Invalid options!")
+        stripes = 1 << (stripes - 1).bit_length()
+        capacity = 1 << (max(capacity, stripes, DEFAULT_CAPACITY) - 1).bit_length()
+        self.hash_function = hash_function if hash_function is not None else partial(fibonacci_hash, seed=seed)
+        self.hash_table = [None] * capacity
+        self.max_load_factor = max_load_factor
+        self.locks = [threading.Lock() for _ in range(stripes)]
+        self.counts = [0] * stripes # keys per stripe, only changed while holding that stripe's lock
+
+    def get_hash_code(self, key):
+        return self.hash_function(key) & (len(self.hash_table) - 1)
+
+    def get_table_size(self):
+        """returns the number of stored keys (a snapshot, other threads may change it right away)."""
+        return sum(self.counts)
+
+    def insert(self, key):
+        """Inserts the key if it is absent, in a single pass over the chain. Same contract as ChainingHashSet.insert.
+        :raises ValueError if the key is None.
+        """
+        if key is None:
+            raise ValueError
+        table, hash_k, stripe = self._lock_bucket(key)
+        try:
+            tail = None
+            current = table[hash_k]
+            while current:
+                if current.key == key:
+                    return False
+                tail = current
+                current = current.next
+            node = ChainingHashNode(key)
+            if tail is None:
+                table[hash_k] = node
             else:
+                tail.next = node
+            self.counts[stripe] += 1
+            grow = self.counts[stripe] > self.max_load_factor * len(table) / len(self.locks)
+        finally:
+            self.locks[stripe].release()
+        if grow:
+            self._grow(len(table))
+        return True
+
+    def contains(self, key):
+        """Same contract as ChainingHashSet.contains.
+        :raises ValueError if the key is None.
+        """
+        if key is None:
+            raise ValueError
+        table, hash_k, stripe = self._lock_bucket(key)
+        try:
+            current = table[hash_k]
+            while current:
+                if current.key == key:
+                    return True
+                current = current.next
+            return False
+        finally:
+            self.locks[stripe].release()
+
+    def remove(self, key):
+        """Same contract as ChainingHashSet.remove.
+        :raises ValueError if the key is None.
+        """
+        if key is None:
+            raise ValueError
+        table, hash_k, stripe = self._lock_bucket(key)
+        try:
+            prev = None
+            current = table[hash_k]
+            while current:
+                if current.key == key:
+                    if prev:
+                        prev.next = current.next
+                    else:
+                        table[hash_k] = current.next
+                    self.counts[stripe] -= 1
+                    return True
                 prev = current
                 current = current.next
+            return False
+        finally:
+            self.locks[stripe].release()
+
+    def clear(self):
+        self._lock_all()
+        try:
+            self.hash_table = [None] * len(self.hash_table)
+            self.counts = [0] * len(self.locks)
+        finally:
+            self._unlock_all()
+
+    def __iter__(self):
+        """Yields a snapshot of all keys, taken while holding all locks."""
+        self._lock_all()
+        try:
+            keys = [key for node in self.hash_table for key in _chain_keys(node)]
+        finally:
+            self._unlock_all()
+        return iter(keys)
+
+    # auxiliary functions
+
+    def _lock_bucket(self, key):
+        # returns (table, bucket index, stripe) with the stripe's lock held; retries if the table was replaced meanwhile
+        h = self.hash_function(key)
+        stripe_mask = len(self.locks) - 1
+        while True:
+            table = self.hash_table
+            hash_k = h & (len(table) - 1)
+            stripe = hash_k & stripe_mask # capacity is a multiple of stripes, so a key's stripe never changes
+            self.locks[stripe].acquire()
+            if table is self.hash_table:
+                return table, hash_k, stripe
+            self.locks[stripe].release()
+
+    def _lock_all(self):
+        for lock in self.locks: # always in the same order, so two resizes can't deadlock
+            lock.acquire()
+
+    def _unlock_all(self):
+        for lock in reversed(self.locks):
+            lock.release()
+
+    def _grow(self, seen_capacity):
+        self._lock_all()
+        try:
+            if len(self.hash_table) != seen_capacity: # another thread grew it already
+                return
+            new_capacity = seen_capacity * 2
+            new_table = [None] * new_capacity
+            for node in self.hash_table:
+                while node:
+                    next_node = node.next
+                    hash_k = self.hash_function(node.key) & (new_capacity - 1)
+                    node.next = new_table[hash_k]
+                    new_table[hash_k] = node
+                    node = next_node
+            self.hash_table = new_table
+        finally:
+            self._unlock_all()
+
+
+class DiskHashSet():
+    """Chaining hash set that lives in a memory-mapped file, for key sets bigger than RAM.
+    File layout (little endian): header, segment table, first bucket segment, then fixed-size records (offset of the
+    next record, key length, encoded key) and further bucket segments in the order they were allocated.
+    A bucket holds the file offset of the first record of its chain (0 = empty). Removed records go to a free list.
+    The bucket array grows by linear hashing: once table_size / bucket count goes above max_load_factor, the next
+    bucket in line is split into two, so chains stay short without ever rehashing the whole file. New buckets live in
+    segments of doubling size (segment k holds buckets initial * 2^(k-1) up to initial * 2^k), so existing
+    buckets never move.
+    Only the pages of the buckets/records a query touches are read, and reopening just maps the file again.
+    Keys must be int, str or bytes (they are stored in a stable encoding and hashed with blake2b, since hash() of
+    str changes between processes).
+    """
+    MAGIC = b'DHST'
+    VERSION = 2
+    # magic, version, reserved, initial bucket count, key size, table size, free list head, end of used space,
+    # bucket count, max load factor
+    HEADER = struct.Struct('<4sHHQQQQQQd')
+    SEGMENTS = struct.Struct('<48Q') # file offset of every bucket segment, 0 = not allocated yet
+    BUCKET = struct.Struct('<Q')
+    RECORD_HEAD = struct.Struct('<QH') # next record, key length
+
+    def __init__(self, path, capacity=64, key_size=32, max_load_factor=1.0):
+        """Opens the set stored in path, or creates a new one if the file doesn't exist.
+        :param path: File of the set.
+        :param capacity: Initial number of buckets of a new file (rounded up to a power of two), ignored when opening.
+        :param key_size: Maximum encoded key length in bytes of a new file, ignored when opening.
+        :param max_load_factor: A bucket is split once table_size / bucket count goes above this,
+                                ignored when opening (the file's value is used).
+        :raises ValueError if the file is not a DiskHashSet file or max_load_factor is not positive.
+        """
+        if max_load_factor <= 0:
+            raise ValueError("Invalid max_load_factor!")
+        exists = os.path.exists(path)
+        self.file = open(path, 'r+b' if exists else 'w+b')
+        try:
+            if exists:
+                header = self.file.read(self.HEADER.size + self.SEGMENTS.size)
+                if len(header) < self.HEADER.size + self.SEGMENTS.size:
+                    raise ValueError("Not a DiskHashSet file!")
+                magic, version, _, self.initial_buckets, self.key_size, _, _, _, _, _ = self.HEADER.unpack_from(header)
+                if magic != self.MAGIC or version != self.VERSION:
+                    raise ValueError("Not a DiskHashSet file!")
+            else:
+                self.initial_buckets = 1 << (max(capacity, 1) - 1).bit_length()
+                self.key_size = key_size
+                records_start = self.HEADER.size + self.SEGMENTS.size + self.BUCKET.size * self.initial_buckets
+                self.file.truncate(records_start)
+                self.file.write(self.HEADER.pack(self.MAGIC, self.VERSION, 0, self.initial_buckets, key_size, 0, 0,
+                                                 records_start, self.initial_buckets, max_load_factor))
+                self.file.write(self.SEGMENTS.pack(self.HEADER.size + self.SEGMENTS.size, *[0] * 47))
+                self.file.flush()
+            self.map = mmap.mmap(self.file.fileno(), 0)
+            if len(self.map) < self._header()[7]:
+                raise ValueError("Not a DiskHashSet file!") # truncated
+        except Exception:
+            self.file.close()
+            raise
+        self.records_start = self.HEADER.size + self.SEGMENTS.size + self.BUCKET.size * self.initial_buckets
+        self.record_size = (self.RECORD_HEAD.size + self.key_size + 7) // 8 * 8
+        self.segments = list(self.SEGMENTS.unpack_from(self.map, self.HEADER.size))
+        self.max_load_factor = self._header()[9]
+        self._set_bucket_count(self._header()[8])
+
+    def close(self):
+        self.map.flush()
+        self.map.close()
+        self.file.close()
+
+    def flush(self):
+        """Writes all changes to disk."""
+        self.map.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get_table_size(self):
+        return self._header()[5]
+
+    def insert(self, key):
+        """Same contract as ChainingHashSet.insert.
+        :raises ValueError if the key is None or its encoding is longer than key_size.
+        """
+        encoded = self._encode(key)
+        bucket = self._bucket_offset(encoded)
+        tail = 0
+        current = self.BUCKET.unpack_from(self.map, bucket)[0]
+        while current:
+            if self._record_key(current) == encoded:
+                return False
+            tail = current
+            current = self.RECORD_HEAD.unpack_from(self.map, current)[0]
+
+        record = self._allocate()
+        self.RECORD_HEAD.pack_into(self.map, record, 0, len(encoded))
+        start = record + self.RECORD_HEAD.size
+        self.map[start:start + len(encoded)] = encoded
+        if tail:
+            self.RECORD_HEAD.pack_into(self.map, tail, record, self.RECORD_HEAD.unpack_from(self.map, tail)[1])
+        else:
+            self.BUCKET.pack_into(self.map, bucket, record)
+        self._update_header(size_change=1)
+        if self.get_table_size() > self.max_load_factor * self.bucket_count:
+            self._split()
+        return True
+
+    def contains(self, key):
+        """Same contract as ChainingHashSet.contains.
+        :raises ValueError if the key is None.
+        """
+        encoded = self._encode(key)
+        current = self.BUCKET.unpack_from(self.map, self._bucket_offset(encoded))[0]
+        while current:
+            if self._record_key(current) == encoded:
+                return True
+            current = self.RECORD_HEAD.unpack_from(self.map, current)[0]
+        return False
+
+    def remove(self, key):
+        """Same contract as ChainingHashSet.remove.
+        :raises ValueError if the key is None.
+        """
+        encoded = self._encode(key)
+        bucket = self._bucket_offset(encoded)
+        prev = 0
+        current = self.BUCKET.unpack_from(self.map, bucket)[0]
+        while current:
+            next_record = self.RECORD_HEAD.unpack_from(self.map, current)[0]
+            if self._record_key(current) == encoded:
+                if prev:
+                    self.RECORD_HEAD.pack_into(self.map, prev, next_record, self.RECORD_HEAD.unpack_from(self.map, prev)[1])
+                else:
+                    self.BUCKET.pack_into(self.map, bucket, next_record)
+                self._release(current)
+                self._update_header(size_change=-1)
+                return True
+            prev = current
+            current = next_record
         return False
 
     def clear(self):
-        """Removes all stored elements from the hash table by setting all nodes to None.
+        """Removes all keys, shrinks back to the initial buckets and gives the rest of the space back to the file system."""
+        self.map[self.HEADER.size:self.records_start] = bytes(self.records_start - self.HEADER.size)
+        self.map[:self.HEADER.size] = self.HEADER.pack(self.MAGIC, self.VERSION, 0, self.initial_buckets, self.key_size,
+                                                       0, 0, self.records_start, self.initial_buckets, self.max_load_factor)
+        self.segments = [self.HEADER.size + self.SEGMENTS.size] + [0] * 47
+        self.SEGMENTS.pack_into(self.map, self.HEADER.size, *self.segments)
+        self._set_bucket_count(self.initial_buckets)
+        self._remap(self.records_start)
+
+    def __iter__(self):
+        """Lazily yields all keys, bucket by bucket."""
+        for i in range(self.bucket_count):
+            current = self.BUCKET.unpack_from(self.map, self._bucket_at(i))[0]
+            while current:
+                yield self._decode(self._record_key(current))
+                current = self.RECORD_HEAD.unpack_from(self.map, current)[0]
+
+    # auxiliary functions
+
+    def _encode(self, key):
+        # stable, type tagged bytes of the key (equal keys of the same type give equal bytes)
+        if key is None:
+            raise ValueError
+        if isinstance(key, bool) or not isinstance(key, (int, str, bytes)):
+            raise TypeError("DiskHashSet keys must be int, str or bytes!")
+        if isinstance(key, int):
+            encoded = b'i' + key.to_bytes((key.bit_length() + 8) // 8, 'little', signed=True)
+        elif isinstance(key, str):
+            encoded = b's' + key.encode('utf-8')
+        else:
+            encoded = b'b' + key
+        if len(encoded) > self.key_size:
+            raise ValueError("Key is too long for this DiskHashSet!")
+        return encoded
+
+    def _decode(self, encoded):
+        tag, data = encoded[:1], encoded[1:]
+        if tag == b'i':
+            return int.from_bytes(data, 'little', signed=True)
+        if tag == b's':
+            return data.decode('utf-8')
+        return data
+
+    def _bucket_offset(self, encoded):
+        return self._bucket_at(self._bucket_index(self._hash(encoded)))
+
+    def _hash(self, encoded):
+        return int.from_bytes(hashlib.blake2b(encoded, digest_size=8).digest(), 'little')
+
+    def _bucket_index(self, h):
+        # linear hashing: buckets before the split pointer were split already and use one more bit
+        index = h & (self.level_size - 1)
+        if index < self.split:
+            index = h & (2 * self.level_size - 1)
+        return index
+
+    def _bucket_at(self, index):
+        # file offset of bucket index, see the segment layout in the class docstring
+        if index < self.initial_buckets:
+            return self.segments[0] + self.BUCKET.size * index
+        k = (index // self.initial_buckets).bit_length()
+        return self.segments[k] + self.BUCKET.size * (index - (self.initial_buckets << (k - 1)))
+
+    def _set_bucket_count(self, bucket_count):
+        self.bucket_count = bucket_count
+        self.level_size = self.initial_buckets << ((bucket_count // self.initial_buckets).bit_length() - 1)
+        self.split = bucket_count - self.level_size # next bucket to split
+
+    def _split(self):
+        # adds bucket level_size + split and moves the keys of bucket split that belong there
+        new_index = self.level_size + self.split
+        if self.split == 0: # first bucket of a new level, needs a new segment of level_size buckets
+            k = (new_index // self.initial_buckets).bit_length()
+            self.segments[k] = self._allocate_space(self.BUCKET.size * self.level_size)
+            self.BUCKET.pack_into(self.map, self.HEADER.size + self.BUCKET.size * k, self.segments[k])
+        old_bucket = self._bucket_at(self.split)
+        new_bucket = self._bucket_at(new_index)
+        current = self.BUCKET.unpack_from(self.map, old_bucket)[0]
+        self.BUCKET.pack_into(self.map, old_bucket, 0)
+        while current:
+            next_record, key_len = self.RECORD_HEAD.unpack_from(self.map, current)
+            h = self._hash(self._record_key(current))
+            target = new_bucket if h & (2 * self.level_size - 1) == new_index else old_bucket
+            self.RECORD_HEAD.pack_into(self.map, current, self.BUCKET.unpack_from(self.map, target)[0], key_len)
+            self.BUCKET.pack_into(self.map, target, current)
+            current = next_record
+        self._set_bucket_count(self.bucket_count + 1)
+        self._update_header(bucket_count=self.bucket_count)
+
+    def _record_key(self, record):
+        key_len = self.RECORD_HEAD.unpack_from(self.map, record)[1]
+        start = record + self.RECORD_HEAD.size
+        return self.map[start:start + key_len]
+
+    def _header(self):
+        return self.HEADER.unpack_from(self.map, 0)
+
+    def _update_header(self, size_change=0, free_head=None, end=None, bucket_count=None):
+        magic, version, reserved, initial, key_size, size, old_free_head, old_end, old_count, load = self._header()
+        self.HEADER.pack_into(self.map, 0, magic, version, reserved, initial, key_size, size + size_change,
+                              old_free_head if free_head is None else free_head, old_end if end is None else end,
+                              old_count if bucket_count is None else bucket_count, load)
+
+    def _allocate(self):
+        # returns the file offset of an unused record, from the free list or the end of the file
+        free_head = self._header()[6]
+        if free_head:
+            self._update_header(free_head=self.RECORD_HEAD.unpack_from(self.map, free_head)[0])
+            return free_head
+        return self._allocate_space(self.record_size)
+
+    def _allocate_space(self, size):
+        # returns the file offset of size zeroed bytes at the end of the used space
+        end = self._header()[7]
+        if end + size > len(self.map):
+            self._remap(max(end + size, 2 * len(self.map))) # doubling, so growing is amortized O(1)
+        self.map[end:end + size] = bytes(size)
+        self._update_header(end=end + size)
+        return end
+
+    def _release(self, record):
+        self.RECORD_HEAD.pack_into(self.map, record, self._header()[6], 0)
+        self._update_header(free_head=record)
+
+    def _remap(self, file_size):
+        self.map.flush()
+        self.map.close()
+        self.file.truncate(file_size)
+        self.map = mmap.mmap(self.file.fileno(), 0)
+
+
+class NumpyIntHashSet():
+    """Open addressing (linear probing) set of int64 keys stored in flat NumPy arrays, no node objects.
+    insert/contains/remove/get_table_size work like in ChainingHashSet, the *_many versions take whole arrays
+    and probe all keys at once (one vectorized step per probe distance instead of one Python call per key).
+    Removed keys leave tombstones, they are cleaned up by the next rebuild.
+    """
+    EMPTY = 0
+    FULL = 1
+    DELETED = 2
+
+    def __init__(self, capacity=0, max_load_factor=0.5):
         """
-        self.hash_table = [None] * self.capacity
+        :param capacity: Initial number of slots (rounded up to a power of two), DEFAULT_CAPACITY if it is 0.
+        :param max_load_factor: The table is rebuilt (bigger, or just without tombstones) once full + deleted slots
+                                go above this fraction of the capacity.
+        :raises ImportError if numpy is not installed.
+        :raises ValueError if max_load_factor is not in (0, 1).
+        """
+        if np is None:
+            raise ImportError("NumpyIntHashSet needs numpy!")
+        if not 0 < max_load_factor < 1:
+            raise ValueError("max_load_factor has to be between 0 and 1!")
+        self.max_load_factor = max_load_factor
+        self.initial_capacity = 1 << (max(capacity, DEFAULT_CAPACITY) - 1).bit_length()
+        self._allocate(self.initial_capacity)
+
+    def get_table_size(self):
+        """returns the number of stored keys."""
+        return self.table_size
+
+    def insert(self, key):
+        """Inserts a key, returns False if it is already in the set.
+        :raises ValueError if the key is None.
+        :raises TypeError if the key is not an integer (e.g. 3.7, which would be truncated to 3).
+        """
+        if key is None:
+            raise ValueError
+        return bool(self.insert_many(np.array([operator.index(key)], dtype=np.int64))[0])
+
+    def contains(self, key):
+        """Returns True if the key is in the set.
+        :raises ValueError if the key is None.
+        :raises TypeError if the key is not an integer.
+        """
+        if key is None:
+            raise ValueError
+        return self._find_slot(operator.index(key)) >= 0
+
+    def remove(self, key):
+        """Removes the key, returns False if it was not in the set.
+        :raises ValueError if the key is None.
+        :raises TypeError if the key is not an integer.
+        """
+        if key is None:
+            raise ValueError
+        slot = self._find_slot(operator.index(key))
+        if slot < 0:
+            return False
+        self.state[slot] = self.DELETED
+        self.table_size -= 1
+        return True
+
+    def clear(self):
+        self._allocate(self.initial_capacity)
+
+    def contains_many(self, keys):
+        """Vectorized contains.
+        :param keys: Array-like of integer keys.
+        :return: Boolean array, True where the key is in the set.
+        :raises TypeError if keys is not an integer array.
+        """
+        keys = self._as_keys(keys)
+        return self._find_slots(keys) >= 0
+
+    def insert_many(self, keys):
+        """Vectorized insert.
+        :param keys: Array-like of integer keys, may contain duplicates.
+        :return: Boolean array, True for keys that were inserted (only the first of repeated keys can be True).
+        :raises TypeError if keys is not an integer array.
+        """
+        keys = self._as_keys(keys)
+        result = np.zeros(len(keys), dtype=bool)
+        if len(keys) == 0:
+            return result
+        unique, first = np.unique(keys, return_index=True)
+        new = self._find_slots(unique) < 0
+        unique, first = unique[new], first[new]
+
+        if self.used + len(unique) > self.max_load_factor * self.capacity:
+            self._rebuild(self.table_size + len(unique))
+        self._place(unique)
+        self.table_size += len(unique)
+        result[first] = True
+        return result
+
+    def remove_many(self, keys):
+        """Vectorized remove.
+        :param keys: Array-like of integer keys, may contain duplicates.
+        :return: Boolean array, True for keys that were removed (only the first of repeated keys can be True).
+        :raises TypeError if keys is not an integer array.
+        """
+        keys = self._as_keys(keys)
+        result = np.zeros(len(keys), dtype=bool)
+        if len(keys) == 0:
+            return result
+        unique, first = np.unique(keys, return_index=True)
+        slots = self._find_slots(unique)
+        found = slots >= 0
+        self.state[slots[found]] = self.DELETED
+        self.table_size -= int(found.sum())
+        result[first[found]] = True
+        return result
+
+    def to_array(self):
+        """Returns all keys as an int64 array (in table order)."""
+        return self.keys[self.state == self.FULL].copy()
+
+    # auxiliary functions
+
+    @staticmethod
+    def _as_keys(keys):
+        # int64 array of the keys, anything but integers is rejected instead of being truncated by the cast
+        keys = np.asarray(keys)
+        if keys.size and keys.dtype.kind not in 'iu':
+            raise TypeError("NumpyIntHashSet keys have to be integers, got " + str(keys.dtype))
+        return keys.astype(np.int64, copy=False)
+
+    def _allocate(self, capacity):
+        self.capacity = capacity
+        self.shift = np.uint64(64 - (capacity.bit_length() - 1))
+        self.keys = np.zeros(capacity, dtype=np.int64)
+        self.state = np.zeros(capacity, dtype=np.uint8)
         self.table_size = 0
+        self.used = 0 # full + deleted slots, decides when to rebuild
 
-    def to_string(self):
-        """Returns a string representation of the hash table (array indices and stored keys) in the format
-            Idx_0 {Node, Node, ... }, Idx_1 {...}
-            e.g.: 0 {13}, 1 {82, 92, 12}, 2 {2, 32}, """
-        s = ''
-        for i in range(len(self.hash_table)):
-            s += str(i)
-            s+= ' {'
-            current = self.hash_table[i]
-            empty = True if current is None else False
+    def _hash_many(self, keys):
+        # Fibonacci hashing, the top bits of the (wrapping) 64 bit product are the slot
+        return ((keys.view(np.uint64) * np.uint64(FIBONACCI_MULTIPLIER)) >> self.shift).astype(np.int64)
 
-            while current:
-                s += str(current.key) + ', '
-                current=current.next
+    def _hash(self, key):
+        # same as _hash_many for a single Python int
+        return (((key & MASK_64) * FIBONACCI_MULTIPLIER) & MASK_64) >> int(self.shift)
+
+    def _find_slot(self, key):
+        mask = self.capacity - 1
+        slot = self._hash(key)
+        state, keys = self.state, self.keys
+        while state[slot] != self.EMPTY:
+            if state[slot] == self.FULL and keys[slot] == key:
+                return slot
+            slot = (slot + 1) & mask
+        return -1
+
+    def _find_slots(self, keys):
+        # slot of every key or -1, each loop iteration advances all keys that are still probing by one slot
+        mask = self.capacity - 1
+        result = np.full(len(keys), -1, dtype=np.int64)
+        pending = np.arange(len(keys))
+        slots = self._hash_many(keys)
+        while len(pending):
+            state = self.state[slots]
+            found = (state == self.FULL) & (self.keys[slots] == keys[pending])
+            result[pending[found]] = slots[found]
+            go_on = ~found & (state != self.EMPTY)
+            pending = pending[go_on]
+            slots = (slots[go_on] + 1) & mask
+        return result
 
-            if not empty:
-                s = s[:-2]
-            
-            s+='}, '
-                
-        return s[:-2]
+    def _place(self, keys):
+        # puts keys that are known to be new into free (empty or deleted) slots
+        mask = self.capacity - 1
+        slots = self._hash_many(keys)
+        while len(keys):
+            free = self.state[slots] != self.FULL
+            # several keys may probe the same free slot in one round, only the first one gets it
+            free_idx = np.flatnonzero(free)
+            _, winner = np.unique(slots[free_idx], return_index=True)
+            winner = free_idx[winner]
+            self.used += int((self.state[slots[winner]] == self.EMPTY).sum())
+            self.keys[slots[winner]] = keys[winner]
+            self.state[slots[winner]] = self.FULL
+            rest = np.ones(len(keys), dtype=bool)
+            rest[winner] = False
+            keys = keys[rest]
+            slots = (slots[rest] + 1) & mask
 
+    def _rebuild(self, needed):
+        # new table that fits needed keys at half the max load factor, also drops all tombstones
+        capacity = self.initial_capacity
+        while needed > self.max_load_factor * capacity / 2:
+            capacity *= 2
+        old = self.to_array()
+        self._allocate(capacity)
+        self._place(old)
+        self.table_size = len(old)
@@ -9,6 +9,8 @@ It includes:
 - Step: Represents a step in a path, including the covered distance.
 - Graph: A general graph structure with methods to manage nodes and edges.
 - JKUMap: A specific graph implementation modeling a map of locations and their connections.
+- CSRGraph: A frozen, compact copy of a Graph in compressed sparse row form (NumPy arrays).
+- ContractionHierarchy: Preprocessed form of a Graph for fast point-to-point queries.
 
 Classes and Key Functionalities:
 1. **Node**:
@@ -48,6 +50,20 @@ Author: [IPC Teaching JKU]
 Date: [13.12.24]
 """
 
+import hashlib
+import heapq
+import os
+import pickle
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+try:
+    import numpy as np
+except ImportError:  # only needed for Graph.freeze / CSRGraph
+    np = None
+
+
 # Class node
 class Node:
     def __init__(self, name):
@@ -105,6 +121,14 @@ class Graph:
         self.edges = []
         self.n_nodes = 0
         self.n_edges = 0
+        # indexes kept in sync by add/add_edge, so lookups don't scan the lists
+        self.node_index = {}  # name -> Node
+        self.node_position = {}  # name -> position in self.nodes
+        self.adjacency = {}   # name -> {neighbor name -> Edge}, in insertion order
+        # connected components as union-find forest (name -> parent name, root name -> component size)
+        self.component_parent = {}
+        self.component_size = {}
+        self.version = 0  # bumped by every change of the graph, so derived data (e.g. cached paths) can tell it's stale
 
     def get_number_of_nodes(self):
         return self.n_nodes
@@ -123,7 +147,13 @@ class Graph:
             return None
         v = Node(name)
         self.nodes.append(v)
+        self.node_index[name] = v
+        self.node_position[name] = self.n_nodes
+        self.adjacency[name] = {}
+        self.component_parent[name] = name
+        self.component_size[name] = 1
         self.n_nodes += 1
+        self.version += 1
         return v
 
     def add_edge(self, v1_name, v2_name, weight):
@@ -135,33 +165,78 @@ class Graph:
             return None
         e = Edge(n1, n2, weight)
         self.edges.append(e)
+        self.adjacency[v1_name][v2_name] = e
+        self.adjacency[v2_name][v1_name] = e
         self.n_edges += 1
+        self.version += 1
+        self._union(v1_name, v2_name)
+        return e
+
+    def update_edge_weight(self, v1_name, v2_name, weight):
+        """
+        Changes the weight of an existing edge in place. Edge hashes include the weight,
+        so edges must not be kept in sets or as dict keys across this call.
+        :return The changed edge, None if there is no such edge.
+        """
+        e = self.find_edge(v1_name, v2_name)
+        if e is None:
+            return None
+        if e.weight != weight:
+            e.weight = weight
+            self.version += 1
         return e
 
     def find(self, name):
-        for v in self.nodes:
-            if v.name == name:
-                return v
-        return None
+        return self.node_index.get(name)
 
     def find_edge(self, v1_name, v2_name):
-        for e in self.edges:
-            if ((e.first.name == v1_name and e.second.name == v2_name) or
-                    (e.first.name == v2_name and e.second.name == v1_name)):
-                return e
-        return None
+        adjacent = self.adjacency.get(v1_name)
+        return adjacent.get(v2_name) if adjacent is not None else None
 
     def neighbors(self, name):
-        v = self.find(name)
-        if v is None:
+        adjacent = self.adjacency.get(name)
+        if adjacent is None:
             return None
-        neighbor_nodes = []
-        for e in self.edges:
-            if e.first.name == v.name:
-                neighbor_nodes.append(e.second)
-            elif e.second.name == v.name:
-                neighbor_nodes.append(e.first)
-        return neighbor_nodes
+        return [self.node_index[neighbor] for neighbor in adjacent]
+
+    def incident_edges(self, name):
+        """Returns (neighbor node, edge) pairs of the given node in O(degree), None if there is no such node."""
+        adjacent = self.adjacency.get(name)
+        if adjacent is None:
+            return None
+        return [(self.node_index[neighbor], e) for neighbor, e in adjacent.items()]
+
+    def freeze(self):
+        """
+        Builds a CSRGraph snapshot of the current graph: node ids are the positions in self.nodes,
+        later changes of the graph are not reflected in it.
+        :raises ImportError: If NumPy is not installed.
+        """
+        return CSRGraph(self)
+
+    def connected(self, v1_name, v2_name):
+        """Returns True if both nodes exist and are in the same connected component (amortized O(1))."""
+        if v1_name not in self.component_parent or v2_name not in self.component_parent:
+            return False
+        return self._component(v1_name) == self._component(v2_name)
+
+    def _component(self, name):
+        # root of the node's union-find tree, with path compression
+        root = name
+        while self.component_parent[root] != root:
+            root = self.component_parent[root]
+        while self.component_parent[name] != root:
+            self.component_parent[name], name = root, self.component_parent[name]
+        return root
+
+    def _union(self, v1_name, v2_name):
+        a, b = self._component(v1_name), self._component(v2_name)
+        if a == b:
+            return
+        if self.component_size[a] < self.component_size[b]: # hang the smaller tree below the bigger one
+            a, b = b, a
+        self.component_parent[b] = a
+        self.component_size[a] += self.component_size.pop(b)
 
 
 # Class JKUMap
@@ -185,8 +260,19 @@ class JKUMap(Graph):
     PAPAYA = "Papaya"
     JKH = "JKH"
 
-    def __init__(self):
+    def __init__(self, cache_size=0):
+        """
+        :param cache_size: Number of shortest path trees (one per start node) kept in an LRU cache,
+        0 (default) disables caching. Every tree holds two dicts with an entry per reachable node.
+        """
         super().__init__()
+        self.cache_size = cache_size
+        self.tree_cache = OrderedDict()  # start node name -> (distances, predecessors), least recently used first
+        self.cache_version = self.version
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.hierarchy = None  # ContractionHierarchy used by get_shortest_path, see build_contraction_hierarchy
+        self.hierarchy_version = None  # graph version the hierarchy belongs to
         self.add(self.SPAR)
         self.add(self.LIT)
         self.add(self.PORTER)
@@ -224,6 +310,69 @@ class JKUMap(Graph):
         self.add_edge(self.LUI, self.TEICHWERK, 135)
         self.add_edge(self.LUI, self.LIBRARY, 90)
 
+    # Cached trees are kept up to date on changes that can only make paths shorter (new nodes/edges, lower
+    # weights) by repairing them in place, only weight increases drop the cache.
+    def add(self, name):
+        cache_valid = self.cache_version == self.version
+        v = super().add(name)
+        if v is not None and cache_valid:
+            self.cache_version = self.version # a node without edges is unreachable, the trees stay correct
+        return v
+
+    def add_edge(self, v1_name, v2_name, weight):
+        cache_valid = self.cache_version == self.version
+        e = super().add_edge(v1_name, v2_name, weight)
+        if e is not None and cache_valid:
+            self._repair_cached_trees(e)
+        return e
+
+    def update_edge_weight(self, v1_name, v2_name, weight):
+        cache_valid = self.cache_version == self.version
+        e = self.find_edge(v1_name, v2_name)
+        old_weight = e.weight if e is not None else None
+        e = super().update_edge_weight(v1_name, v2_name, weight)
+        if e is not None and cache_valid and weight <= old_weight:
+            self._repair_cached_trees(e)
+        return e
+
+    def _repair_cached_trees(self, edge):
+        for distances, predecessors in self.tree_cache.values():
+            self.repair_shortest_path_tree(distances, predecessors, edge)
+        self.cache_version = self.version
+
+    def repair_shortest_path_tree(self, distances, predecessors, edge):
+        """
+        Updates a complete tree from shortest_path_tree after edge was added or got a lower weight, without
+        searching from scratch: the improvement is propagated from the edge's ends and only nodes that get
+        closer are visited. Distances are the same as a new search would give, but ties between equally long
+        paths may be resolved differently.
+        Weight increases can't be repaired this way, the tree has to be recomputed then.
+        :param distances: Dict of the tree, updated in place.
+        :param predecessors: Dict of the tree, updated in place.
+        :param edge: The new or cheaper edge (must be in the graph already).
+        :return Number of nodes whose distance got smaller.
+        """
+        inf = float('inf')
+        heap = []
+        for u, z in ((edge.first.name, edge.second.name), (edge.second.name, edge.first.name)):
+            if u in distances and distances[u] + edge.weight < distances.get(z, inf):
+                distances[z] = distances[u] + edge.weight
+                predecessors[z] = u
+                heapq.heappush(heap, (distances[z], z))
+
+        improved = set()
+        while heap:
+            d, u = heapq.heappop(heap)
+            if d > distances[u]:
+                continue # outdated entry
+            improved.add(u)
+            for z, e in self.adjacency[u].items():
+                if d + e.weight < distances.get(z, inf):
+                    distances[z] = d + e.weight
+                    predecessors[z] = u
+                    heapq.heappush(heap, (distances[z], z))
+        return len(improved)
+
     def get_shortest_path(self, from_node, to_node):
         """
         This method determines the amount of "steps" needed on the shortest paths
@@ -241,14 +390,19 @@ class JKUMap(Graph):
         if from_node is None or to_node is None or from_node is to_node:
             raise ValueError
         
-        visited = []
-        distances = dict()
-        paths = dict()
-        self.init_shortest_path_structures(from_node, distances, paths)
-
-        distances, paths = self.dijkstra(from_node, visited, distances, paths)
+        if not self.connected(from_node.name, to_node.name):
+            return None
+        if self.hierarchy is not None and self.hierarchy_version == self.version: # ignored once the graph changed
+            return self.hierarchy.get_shortest_path(from_node.name, to_node.name, self.node_index)
+        tree = self.cached_shortest_path_tree(from_node, compute=False)
+        if tree is None: # not cached, stop once to_node is settled
+            settled = []
+            tree = self.shortest_path_tree(from_node, settled, target=to_node)
+            if self.cache_size > 0 and len(settled) == self.component_size[self._component(from_node.name)]:
+                self._cache_tree(from_node.name, tree) # to_node happened to be settled last, so the tree is complete
+        distances, predecessors = tree
 
-        return paths[to_node] if paths[to_node] != [] else None
+        return self.build_path(to_node, distances, predecessors) # only the requested path is turned into Steps
      
 
     def get_shortest_distances(self, from_node):
@@ -265,14 +419,10 @@ class JKUMap(Graph):
         if from_node is None:
             raise ValueError
         
-        visited = []
-        distances = dict()
-        paths = dict()
-        self.init_shortest_path_structures(from_node, distances, paths)
-
-        distances, paths = self.dijkstra(from_node, visited, distances, paths)
+        tree = self.cached_shortest_path_tree(from_node)
+        distances, _ = tree if tree is not None else self.shortest_path_tree(from_node)
 
-        distances_names = {node.name: dist for node, dist in distances.items()} # just for unittest compatibility, since its looking for nodes by their names
+        distances_names = {node.name: distances.get(node.name, -1) for node in self.nodes} # just for unittest compatibility, since its looking for nodes by their names
 
         return distances_names
 
@@ -284,12 +434,99 @@ class JKUMap(Graph):
         :return true if a path exists, false otherwise
         :throws ValueError If from or to is null.
         """
-        if from_node is None or to_node is None:
+        if from_node is None or to_node is None or from_node is to_node: # same node was rejected by get_shortest_path before
             raise ValueError
 
-        path = self.get_shortest_path(from_node, to_node)
+        return self.connected(from_node.name, to_node.name) # component index, no search needed
 
-        return True if path is not None else False
+    def cached_shortest_path_tree(self, from_node, compute=True):
+        """
+        Returns the shortest path tree of from_node (see shortest_path_tree) from the LRU cache,
+        computing and caching it on a miss. Trees are repaired on new edges and lower weights,
+        the cache is dropped on every other change of the graph.
+        The returned dicts are shared with the cache and must not be modified.
+        :param compute: If False, a miss returns None instead of running a search.
+        :return (distances, predecessors), None if caching is disabled.
+        """
+        if self.cache_size <= 0:
+            return None
+        if self.cache_version != self.version: # graph changed since the trees were computed
+            self.tree_cache.clear()
+            self.cache_version = self.version
+        tree = self.tree_cache.get(from_node.name)
+        if tree is not None:
+            self.cache_hits += 1
+            self.tree_cache.move_to_end(from_node.name)
+            return tree
+        self.cache_misses += 1
+        if not compute:
+            return None
+        tree = self.shortest_path_tree(from_node)
+        self._cache_tree(from_node.name, tree)
+        return tree
+
+    def _cache_tree(self, name, tree):
+        # only complete trees may be cached, the cache must be up to date (see cached_shortest_path_tree)
+        self.tree_cache[name] = tree
+        if len(self.tree_cache) > self.cache_size:
+            self.tree_cache.popitem(last=False) # evict the least recently used start node
+
+    def get_cache_stats(self):
+        """
+        :return: dict with hits, misses, hit_rate, size (cached trees) and capacity of the shortest path tree cache.
+        """
+        lookups = self.cache_hits + self.cache_misses
+        return {
+            'hits': self.cache_hits,
+            'misses': self.cache_misses,
+            'hit_rate': self.cache_hits / lookups if lookups else 0.0,
+            'size': len(self.tree_cache) if self.cache_version == self.version else 0,
+            'capacity': self.cache_size,
+        }
+
+    def clear_cache(self):
+        """Drops all cached shortest path trees and resets the hit/miss counters."""
+        self.tree_cache.clear()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def build_contraction_hierarchy(self):
+        """
+        Preprocesses the current graph into a ContractionHierarchy that get_shortest_path uses from now on,
+        as long as the graph is not changed (after a change it falls back to plain Dijkstra until this is called again).
+        :return The new ContractionHierarchy (can be saved with its save method).
+        """
+        self.hierarchy = ContractionHierarchy(self)
+        self.hierarchy_version = self.version
+        return self.hierarchy
+
+    def set_contraction_hierarchy(self, hierarchy):
+        """
+        Uses a hierarchy built before, e.g. one from ContractionHierarchy.load, for get_shortest_path.
+        None switches back to plain Dijkstra.
+        :raises ValueError: If the hierarchy was built for a graph with other nodes, edges or weights.
+        """
+        if hierarchy is not None:
+            if hierarchy.names != [node.name for node in self.nodes]:
+                raise ValueError("hierarchy was built for another graph")
+            if hierarchy.fingerprint != ContractionHierarchy.edge_fingerprint(self):
+                raise ValueError("hierarchy was built for other edges or weights")
+        self.hierarchy = hierarchy
+        self.hierarchy_version = self.version
+
+    def distance_matrix(self, sources, targets=None, workers=None):
+        """
+        Shortest distances between many nodes at once, see CSRGraph.distance_matrix.
+        :param sources: Start nodes (rows)
+        :param targets: Target nodes (columns), all nodes in the order of self.nodes if None.
+        :param workers: Number of worker processes, os.cpu_count() if None, 1 runs in this process.
+        :return float64 matrix of shape (len(sources), len(targets)), inf where there is no path.
+        :raises ValueError: If a node is None.
+        """
+        if any(node is None for node in sources) or (targets is not None and any(node is None for node in targets)):
+            raise ValueError
+        return self.freeze().distance_matrix([node.name for node in sources],
+                                             None if targets is None else [node.name for node in targets], workers)
 
     def init_shortest_path_structures(self, from_node, distances, paths):
         for v in self.get_nodes():
@@ -311,32 +548,535 @@ class JKUMap(Graph):
         :param paths: Dict (nnodes entries) which stores the shortest path to each node.
         """
 
-        Q = sorted(distances.items(), key=lambda item: item[1])
-        while Q:
-            Q = sorted(Q, key=lambda item: item[1]) # sorts every run, which is not ideal but idk if were allowed to import an actual pqueue
-            Q_keys = [item[0] for item in Q]
+        # kept for callers of the old interface, get_shortest_path/get_shortest_distances use shortest_path_tree directly
+        tree_distances, predecessors = self.shortest_path_tree(cur, visited)
+        for node in distances:
+            distances[node] = tree_distances.get(node.name, -1)
+        for node in paths:
+            paths[node] = self.build_path(node, tree_distances, predecessors) or []
+        visited.extend(node for node in self.nodes if node.name not in tree_distances)
+
+        return distances, paths
 
-            u = Q.pop(0)[0]
-            Q_keys.pop(0)
-            visited.append(u)
-            zs = self.neighbors(u.name)
+    def shortest_path_tree(self, from_node, visited=None, target=None):
+        """
+        Heap-based Dijkstra from from_node. Outdated heap entries are skipped when popped (lazy deletion)
+        instead of being updated in place, settled nodes are kept in a set.
+        :param from_node: Start node
+        :param visited: Optional list, settled nodes are appended in the order they are settled.
+        :param target: Optional node, the search stops as soon as it is settled (its path is final then,
+        distances of other nodes may be missing or too big).
+        :return (distances, predecessors): dicts keyed by node name with the distance of every reachable node
+        and the name of the node before it on its shortest path (None for from_node). Use build_path for a path.
+        """
+        inf = float('inf')
+        source = from_node.name
+        distances = {source: 0}
+        predecessors = {source: None}
+        # Ties between equal distances are broken exactly like the old "stable sort the whole queue every round"
+        # version did, so paths stay identical: a key is (distance, round of the last update, key the previous
+        # round's sort saw), so on equal distances the node that got there first, or had the smaller key
+        # before, wins; nodes that were never reached compare by their position in self.nodes.
+        keys = {source: (0, -1, ())}
+        updated_in = {}
+        heap = [(keys[source], source)]
+        settled = set()
+        rounds = 0
 
-            for z in zs:
-                if z in Q_keys:
-                    w = self.find_edge(u.name, z.name).weight
-                    if distances[u] + w < distances[z]:
-                        distances[z] = distances[u] + w
+        while heap:
+            key, u = heapq.heappop(heap)
+            if u in settled or key is not keys[u]:
+                continue # outdated entry
+            settled.add(u)
+            if visited is not None:
+                visited.append(self.node_index[u])
+            if target is not None and u == target.name:
+                break
+            du = distances[u]
+            for z, e in self.adjacency[u].items():
+                if z in settled:
+                    continue
+                d = du + e.weight
+                if d < distances.get(z, inf):
+                    old_key = keys.get(z)
+                    if old_key is None:
+                        previous = (inf, 0, self.node_position[z])
+                    elif updated_in[z] == rounds:
+                        previous = old_key[2] # improved twice in one round, the sort only saw the key before this round
+                    else:
+                        previous = old_key
+                    keys[z] = (d, rounds, previous)
+                    updated_in[z] = rounds
+                    distances[z] = d
+                    predecessors[z] = u
+                    heapq.heappush(heap, (keys[z], z))
+            rounds += 1
 
-                        i = [i for i in range(len(Q)) if Q[i][0]==z][0]
-                        Q[i] = (z, distances[z])
+        return distances, predecessors
 
-                        paths[z] = paths[u][:]  
-                        paths[z].append(Step(z, distances[z]))
-                         
+    def get_shortest_path_bidirectional(self, from_node, to_node):
+        """
+        Point-to-point shortest path, searching from both ends at once until the two searches meet,
+        which usually settles far fewer nodes than a search from from_node alone.
+        The distance is always the shortest one, but if several shortest paths exist it may pick a different one
+        than get_shortest_path.
+        :return The path as list of Steps like get_shortest_path, None if there is no path.
+        :raises ValueError: If from_node or to_node is None or they are the same node.
+        """
+        if from_node is None or to_node is None or from_node is to_node:
+            raise ValueError
+        if not self.connected(from_node.name, to_node.name):
+            return None
+        source, target = from_node.name, to_node.name
+        inf = float('inf')
+        # index 0 searches forward from source, index 1 backward from target (edges are undirected)
+        distances = ({source: 0}, {target: 0})
+        parents = ({source: None}, {target: None})
+        heaps = ([(0, source)], [(0, target)])
+        settled = (set(), set())
+        best, meeting = inf, None
 
-        for node, dist in distances.items(): 
-            if dist == float('inf'):
-                distances[node] = -1
+        while heaps[0] and heaps[1]:
+            if heaps[0][0][0] + heaps[1][0][0] >= best: # no shorter path can be found anymore
+                break
+            side = 0 if heaps[0][0][0] <= heaps[1][0][0] else 1 # expand the side with the closer frontier
+            d, u = heapq.heappop(heaps[side])
+            if u in settled[side] or d > distances[side][u]:
+                continue
+            settled[side].add(u)
+            for z, e in self.adjacency[u].items():
+                nd = d + e.weight
+                if nd < distances[side].get(z, inf):
+                    distances[side][z] = nd
+                    parents[side][z] = u
+                    heapq.heappush(heaps[side], (nd, z))
+                if z in distances[1 - side] and nd + distances[1 - side][z] < best:
+                    best = nd + distances[1 - side][z]
+                    meeting = (u, z) if side == 0 else (z, u) # edge u-z joins both halves
+
+        if meeting is None:
+            return None
+        # forward half up to meeting[0], then the backward half from meeting[1] to the target
+        names = []
+        name = meeting[0]
+        while name is not None:
+            names.append(name)
+            name = parents[0][name]
+        names.reverse()
+        name = meeting[1]
+        while name is not None:
+            names.append(name)
+            name = parents[1][name]
+
+        path = [Step(self.node_index[names[0]], 0)]
+        for prev, name in zip(names, names[1:]):
+            path.append(Step(self.node_index[name], path[-1].covered_distance + self.adjacency[prev][name].weight))
+        return path
+
+    def build_path(self, to_node, distances, predecessors):
+        """
+        Builds the Step list for to_node from the result of shortest_path_tree.
+        :return The path from the start node to to_node, None if to_node is not reachable.
+        """
+        name = to_node.name
+        if name not in distances:
+            return None
+        path = []
+        while name is not None:
+            path.append(Step(self.node_index[name], distances[name]))
+            name = predecessors[name]
+        path.reverse()
+        return path
+
+
+# Class CSRGraph
+class CSRGraph:
+    """
+    Read-only compressed sparse row form of a Graph. The neighbors of node id u are
+    indices[indptr[u]:indptr[u + 1]] with the edge weights at the same positions in weights,
+    so an edge costs 12 bytes (int32 id + float64 weight) per direction instead of an Edge object.
+    """
+
+    def __init__(self, graph):
+        """
+        :param graph: Graph to copy, see Graph.freeze.
+        :raises ImportError: If NumPy is not installed.
+        """
+        if np is None:
+            raise ImportError("CSRGraph requires numpy")
+        self.names = [node.name for node in graph.nodes]  # id -> name
+        self.ids = dict(graph.node_position)  # name -> id
+        self.version = graph.version  # graph version the snapshot was taken at
+        n = len(self.names)
+        degrees = np.fromiter((len(graph.adjacency[name]) for name in self.names), dtype=np.int64, count=n)
+        self.indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(degrees, out=self.indptr[1:])
+        n_entries = int(self.indptr[-1])
+        id_type = np.int32 if n < 2 ** 31 else np.int64
+        self.indices = np.fromiter((self.ids[z] for name in self.names for z in graph.adjacency[name]),
+                                   dtype=id_type, count=n_entries)
+        self.weights = np.fromiter((e.weight for name in self.names for e in graph.adjacency[name].values()),
+                                   dtype=np.float64, count=n_entries)
+
+    def get_number_of_nodes(self):
+        return len(self.names)
+
+    def nbytes(self):
+        """Memory used by the CSR arrays in bytes (without the name mapping)."""
+        return self.indptr.nbytes + self.indices.nbytes + self.weights.nbytes
+
+    def shortest_path_tree(self, source, target=None):
+        """
+        Heap-based Dijkstra on node ids.
+        :param source: Start node id
+        :param target: Optional node id, the search stops as soon as it is settled.
+        :return (distances, predecessors): float64 array with inf for unreachable nodes
+        and int64 array with the previous node id on the shortest path (-1 for the start and unreachable nodes).
+        """
+        n = len(self.indptr) - 1
+        inf = float('inf')
+        # plain lists in the loop, indexing numpy arrays element-wise from python is slower
+        distances = [inf] * n
+        predecessors = [-1] * n
+        settled = bytearray(n)
+        indptr, indices, weights = self.indptr, self.indices, self.weights
+        distances[source] = 0.0
+        heap = [(0.0, source)]
+
+        while heap:
+            du, u = heapq.heappop(heap)
+            if settled[u]:
+                continue # outdated entry
+            settled[u] = 1
+            if u == target:
+                break
+            start, end = indptr[u], indptr[u + 1]
+            for z, w in zip(indices[start:end].tolist(), weights[start:end].tolist()):
+                d = du + w
+                if d < distances[z]:
+                    distances[z] = d
+                    predecessors[z] = u
+                    heapq.heappush(heap, (d, z))
+
+        return np.array(distances, dtype=np.float64), np.array(predecessors, dtype=np.int64)
+
+    def distance_matrix(self, sources, targets=None, workers=None):
+        """
+        Runs one shortest path search per source, spread over a process pool. The CSR arrays and the result matrix
+        are put into shared memory once, so the workers don't get the graph pickled with every task
+        and write their rows directly into the result.
+        :param sources: Start node names (rows)
+        :param targets: Target node names (columns), all node ids in order if None.
+        :param workers: Number of worker processes, os.cpu_count() if None, 1 runs in this process.
+        :return float64 matrix of shape (len(sources), len(targets)), inf where there is no path.
+        :raises KeyError: If one of the nodes doesn't exist.
+        """
+        source_ids = [self.ids[name] for name in sources]
+        target_ids = None if targets is None else np.array([self.ids[name] for name in targets], dtype=np.int64)
+        n_columns = len(self.names) if target_ids is None else len(target_ids)
+        if workers is None:
+            workers = os.cpu_count() or 1
+        workers = min(workers, len(source_ids))
+
+        if workers <= 1:
+            result = np.empty((len(source_ids), n_columns), dtype=np.float64)
+            _fill_distance_rows(self, source_ids, 0, target_ids, result)
+            return result
+
+        blocks = []
+        try:
+            arrays = {}
+            for key, array in (('indptr', self.indptr), ('indices', self.indices), ('weights', self.weights),
+                               ('result', np.empty((len(source_ids), n_columns), dtype=np.float64))):
+                block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+                blocks.append(block)
+                np.ndarray(array.shape, array.dtype, buffer=block.buf)[...] = array
+                arrays[key] = (block.name, array.shape, array.dtype.str)
+            # a few chunks per worker, so one slow chunk doesn't leave the other workers idle
+            chunk = max(1, -(-len(source_ids) // (workers * 4)))
+            with ProcessPoolExecutor(workers, initializer=_attach_shared_csr, initargs=(arrays,)) as pool:
+                futures = [pool.submit(_shared_distance_rows, source_ids[i:i + chunk], i, target_ids)
+                           for i in range(0, len(source_ids), chunk)]
+                for future in futures:
+                    future.result() # re-raises errors of the workers
+            return np.ndarray((len(source_ids), n_columns), np.float64, buffer=blocks[-1].buf).copy()
+        finally:
+            for block in blocks:
+                block.close()
+                block.unlink()
+
+    def get_shortest_distances(self, from_name):
+        """
+        :return float64 array with the shortest distance from from_name to every node id, inf if unreachable.
+        :raises KeyError: If there is no node from_name.
+        """
+        distances, _ = self.shortest_path_tree(self.ids[from_name])
+        return distances
+
+    def get_shortest_path(self, from_name, to_name):
+        """
+        :return The path as list of Steps like JKUMap.get_shortest_path (with new Node objects),
+        None if there is no path.
+        :raises KeyError: If one of the nodes doesn't exist.
+        """
+        source, target = self.ids[from_name], self.ids[to_name]
+        distances, predecessors = self.shortest_path_tree(source, target)
+        if distances[target] == float('inf'):
+            return None
+        path = []
+        u = target
+        while u != -1:
+            path.append(Step(Node(self.names[u]), distances[u].item()))
+            u = predecessors[u]
+        path.reverse()
+        return path
+
+
+# Class ContractionHierarchy
+class ContractionHierarchy:
+    """
+    Contraction hierarchy of an undirected Graph. Nodes are contracted one by one, least important first, adding
+    shortcut edges between the neighbors of a contracted node where it was on the only shortest path between them.
+    A query then only has to search upwards (to more important nodes) from both ends.
+    Node ids are positions in Graph.nodes, up[u] maps every more important neighbor of u to (weight, middle) where
+    middle is the id of the contracted node a shortcut skips, None for an original edge.
+    """
+
+    WITNESS_LIMIT = 500 # settled nodes per witness search, a failed search only costs an unneeded shortcut
+
+    def __init__(self, graph):
+        """
+        :param graph: Graph to preprocess, see JKUMap.build_contraction_hierarchy.
+        """
+        self.names = [node.name for node in graph.nodes]  # id -> name
+        self.ids = dict(graph.node_position)  # name -> id
+        self.fingerprint = self.edge_fingerprint(graph)  # edges the hierarchy was built from, see set_contraction_hierarchy
+        n = len(self.names)
+        # remaining graph, neighbor id -> (weight, middle); contracted nodes are removed from their neighbors
+        adjacency = [{} for _ in range(n)]
+        for u, name in enumerate(self.names):
+            for neighbor, e in graph.adjacency[name].items():
+                v = self.ids[neighbor]
+                if v != u:
+                    adjacency[u][v] = (e.weight, None)
+        self.rank = [0] * n  # contraction order, higher is more important
+        self.up = [None] * n
+        self.n_shortcuts = 0
+
+        deleted_neighbors = [0] * n
+        heap = [(self._priority(adjacency, v, deleted_neighbors), v) for v in range(n)]
+        heapq.heapify(heap)
+        order = 0
+        while heap:
+            _, v = heapq.heappop(heap)
+            # lazy updates: priorities get outdated when neighbors are contracted, recheck before contracting
+            shortcuts = self._shortcuts(adjacency, v)
+            priority = len(shortcuts) - len(adjacency[v]) + deleted_neighbors[v]
+            if heap and priority > heap[0][0]:
+                heapq.heappush(heap, (priority, v))
+                continue
+            for u, w, weight in shortcuts:
+                if weight < adjacency[u].get(w, (float('inf'),))[0]:
+                    if w not in adjacency[u]:
+                        self.n_shortcuts += 1
+                    adjacency[u][w] = adjacency[w][u] = (weight, v)
+            for u in adjacency[v]:
+                del adjacency[u][v]
+                deleted_neighbors[u] += 1
+            self.up[v] = adjacency[v] # only more important nodes are left as neighbors
+            adjacency[v] = None
+            self.rank[v] = order
+            order += 1
+
+    @staticmethod
+    def _priority(adjacency, v, deleted_neighbors):
+        # edge difference (shortcuts added - edges removed) plus contracted neighbors, spreads contraction evenly
+        return len(ContractionHierarchy._shortcuts(adjacency, v)) - len(adjacency[v]) + deleted_neighbors[v]
+
+    @staticmethod
+    def edge_fingerprint(graph):
+        """
+        :return (number of edges, hash of all (node id, node id, weight) triples), independent of the order the
+        edges were added in. hashlib instead of hash(), so it stays the same in other processes.
+        """
+        ids = graph.node_position
+        triples = sorted((min(ids[e.first.name], ids[e.second.name]), max(ids[e.first.name], ids[e.second.name]),
+                          repr(e.weight)) for e in graph.edges)
+        digest = hashlib.blake2b(repr(triples).encode(), digest_size=16).hexdigest()
+        return len(triples), digest
+
+    @staticmethod
+    def _shortcuts(adjacency, v):
+        """Returns (u, w, weight) for every pair of neighbors of v that needs a shortcut if v is contracted."""
+        shortcuts = []
+        neighbors = list(adjacency[v].items())
+        for i, (u, (weight_u, _)) in enumerate(neighbors):
+            targets = {w: weight_u + weight_w for w, (weight_w, _) in neighbors[i + 1:]}
+            if not targets:
+                continue
+            witness = ContractionHierarchy._witness_search(adjacency, u, v, targets)
+            for w, weight in targets.items():
+                if witness.get(w, float('inf')) > weight: # no path without v that is as short
+                    shortcuts.append((u, w, weight))
+        return shortcuts
+
+    @staticmethod
+    def _witness_search(adjacency, source, excluded, targets):
+        # bounded Dijkstra from source in the remaining graph without excluded
+        max_distance = max(targets.values())
+        remaining = len(targets)
+        distances = {source: 0}
+        heap = [(0, source)]
+        settled = 0
+        while heap and settled < ContractionHierarchy.WITNESS_LIMIT:
+            d, u = heapq.heappop(heap)
+            if d > distances[u]:
+                continue
+            if d > max_distance:
+                break
+            settled += 1
+            if u in targets:
+                remaining -= 1
+                if remaining == 0:
+                    break
+            for z, (weight, _) in adjacency[u].items():
+                if z != excluded and d + weight < distances.get(z, float('inf')):
+                    distances[z] = d + weight
+                    heapq.heappush(heap, (d + weight, z))
+        return distances
+
+    def query(self, source, target):
+        """
+        Bidirectional Dijkstra that only follows edges upwards in the hierarchy from both ends.
+        :param source: Start node id
+        :param target: Target node id
+        :return The path as list of node ids (shortcuts unpacked), None if there is no path.
+        """
+        if source == target:
+            return [source]
+        inf = float('inf')
+        distances = ({source: 0}, {target: 0})
+        parents = ({source: None}, {target: None})
+        heaps = ([(0, source)], [(0, target)])
+        best, meeting = inf, None
+
+        while (heaps[0] and heaps[0][0][0] < best) or (heaps[1] and heaps[1][0][0] < best):
+            # both searches may go past the meeting point, they only stop once nothing shorter can be found
+            side = 0 if heaps[0] and (not heaps[1] or heaps[0][0][0] <= heaps[1][0][0]) else 1
+            d, u = heapq.heappop(heaps[side])
+            if d > distances[side][u]:
+                continue
+            if d >= best:
+                heaps[side].clear()
+                continue
+            other = distances[1 - side].get(u)
+            if other is not None and d + other < best:
+                best, meeting = d + other, u
+            # stall on demand: if a more important neighbor already gives a shorter way to u,
+            # u can't be on the shortest up-down path, so its edges don't have to be followed
+            if any(distances[side].get(z, inf) + weight < d for z, (weight, _) in self.up[u].items()):
+                continue
+            for z, (weight, _) in self.up[u].items():
+                if d + weight < distances[side].get(z, inf):
+                    distances[side][z] = d + weight
+                    parents[side][z] = u
+                    heapq.heappush(heaps[side], (d + weight, z))
+
+        if meeting is None:
+            return None
+        upward = [] # source ... meeting, then meeting ... target
+        u = meeting
+        while u is not None:
+            upward.append(u)
+            u = parents[0][u]
+        upward.reverse()
+        u = parents[1][meeting]
+        while u is not None:
+            upward.append(u)
+            u = parents[1][u]
+
+        path = [upward[0]]
+        for u, v in zip(upward, upward[1:]):
+            self._unpack(u, v, path)
+        return path
+
+    def _unpack(self, u, v, path):
+        # appends the original nodes after u on edge u-v (u itself is already in path), explicit stack instead of recursion
+        stack = [(u, v)]
+        while stack:
+            a, b = stack.pop()
+            low, high = (a, b) if self.rank[a] < self.rank[b] else (b, a)
+            middle = self.up[low][high][1]
+            if middle is None:
+                path.append(b)
+            else:
+                stack.append((middle, b)) # a-middle first, so it goes on the stack last
+                stack.append((a, middle))
+
+    def get_shortest_path(self, from_name, to_name, node_index):
+        """
+        :param node_index: Name -> Node dict of the graph (Graph.node_index), used for the Steps.
+        :return The path as list of Steps like JKUMap.get_shortest_path, None if there is no path.
+        If several shortest paths exist, it may pick a different one than JKUMap.get_shortest_path.
+        :raises KeyError: If one of the nodes doesn't exist.
+        """
+        ids = self.query(self.ids[from_name], self.ids[to_name])
+        if ids is None:
+            return None
+        path = [Step(node_index[self.names[ids[0]]], 0)]
+        for u, v in zip(ids, ids[1:]):
+            low, high = (u, v) if self.rank[u] < self.rank[v] else (v, u)
+            path.append(Step(node_index[self.names[v]], path[-1].covered_distance + self.up[low][high][0]))
+        return path
+
+    def save(self, path):
+        """Writes the hierarchy (node order and upward graph with shortcuts) to a pickle file, see load."""
+        with open(path, 'wb') as f:
+            pickle.dump({'names': self.names, 'rank': self.rank, 'up': self.up, 'fingerprint': self.fingerprint,
+                         'n_shortcuts': self.n_shortcuts}, f, pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Reads a hierarchy written by save, use JKUMap.set_contraction_hierarchy to query with it.
+        Only load trusted files, they are unpickled.
+        """
+        with open(path, 'rb') as f:
+            data = pickle.load(f)
+        hierarchy = cls.__new__(cls)
+        hierarchy.names = data['names']
+        hierarchy.ids = {name: i for i, name in enumerate(hierarchy.names)}
+        hierarchy.rank = data['rank']
+        hierarchy.up = data['up']
+        hierarchy.fingerprint = data['fingerprint']
+        hierarchy.n_shortcuts = data['n_shortcuts']
+        return hierarchy
+
+
+def _fill_distance_rows(csr, source_ids, first_row, target_ids, result):
+    # one search per source, row first_row + i of result gets the distances of source_ids[i]
+    for i, source in enumerate(source_ids):
+        distances, _ = csr.shortest_path_tree(source)
+        result[first_row + i] = distances if target_ids is None else distances[target_ids]
+
+
+# state of a distance_matrix worker process, set up once by _attach_shared_csr
+_shared_blocks = []
+_shared_csr = None
+_shared_result = None
+
+
+def _attach_shared_csr(arrays):
+    global _shared_csr, _shared_result
+    views = {}
+    for key, (name, shape, dtype) in arrays.items():
+        block = shared_memory.SharedMemory(name=name)
+        _shared_blocks.append(block) # keep the mapping open as long as the worker lives
+        views[key] = np.ndarray(shape, np.dtype(dtype), buffer=block.buf)
+    _shared_csr = CSRGraph.__new__(CSRGraph) # only the arrays are needed for the search, no names
+    _shared_csr.indptr, _shared_csr.indices, _shared_csr.weights = views['indptr'], views['indices'], views['weights']
+    _shared_result = views['result']
 
-        return distances, paths
 
+def _shared_distance_rows(source_ids, first_row, target_ids):
+    _fill_distance_rows(_shared_csr, source_ids, first_row, target_ids, _shared_result)
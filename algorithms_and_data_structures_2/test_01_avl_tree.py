@@ -0,0 +1,260 @@
+import importlib.util
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+# the module name starts with a digit, so it can't be imported with a normal import statement
+_spec = importlib.util.spec_from_file_location(
+    'avl_tree', os.path.join(os.path.dirname(os.path.abspath(__file__)), '01_avl_tree.py'))
+avl_tree = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(avl_tree)
+AVLTree = avl_tree.AVLTree
+ConcurrentAVLTree = avl_tree.ConcurrentAVLTree
+PersistentAVLTree = avl_tree.PersistentAVLTree
+MappedAVLTree = avl_tree.MappedAVLTree
+
+BLOCK = 100  # keys per writer batch
+
+
+def run_stress(readers=4, batches=200, base_size=20000):
+    """Readers do find_by_key and items while one writer calls apply_batch.
+    Batch i inserts the block of keys starting at base_size + i * BLOCK and removes the block before it,
+    so a consistent reader always sees exactly one block (or none before the first batch) above base_size.
+    :return (list of errors seen by readers, number of reads, writer batches per second)
+    """
+    tree = ConcurrentAVLTree(AVLTree.from_sorted((k, k) for k in range(base_size)))
+    stop = threading.Event()
+    errors = []
+    reads = [0] * readers
+
+    def reader(index):
+        rnd = random.Random(index)
+        try:
+            while not stop.is_set():
+                key = rnd.randrange(base_size)
+                if tree.find_by_key(key) != key:
+                    errors.append(('find_by_key', key))
+                window = tree.items(key, key + 20)
+                if [k for k, _ in window] != list(range(key, min(key + 21, base_size))):
+                    errors.append(('items', key))
+                dynamic = tree.items(base_size)
+                if len(dynamic) not in (0, BLOCK) or any(k != v for k, v in dynamic):
+                    errors.append(('batch', len(dynamic))) # a batch was seen half applied
+                reads[index] += 3
+        except Exception as e: # e.g. walking into a node that is being rotated, would otherwise only kill the thread
+            errors.append(('exception', repr(e)))
+
+    def writer():
+        for i in range(batches):
+            start = base_size + i * BLOCK
+            inserts = [(k, k) for k in range(start, start + BLOCK)]
+            tree.apply_batch(inserts, range(start - BLOCK, start) if i > 0 else ())
+
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    for thread in threads:
+        thread.start()
+    start_time = time.perf_counter()
+    writer()
+    elapsed = time.perf_counter() - start_time
+    stop.set()
+    for thread in threads:
+        thread.join()
+    tree.tree.verify_tree()
+    if tree.getSize() != base_size + BLOCK:
+        errors.append(('size', tree.getSize()))
+    return errors, sum(reads), batches / elapsed
+
+
+class TestConcurrentAVLTree(unittest.TestCase):
+
+    def test_readers_and_batch_writer(self):
+        errors, reads, _ = run_stress(readers=4, batches=100)
+        self.assertEqual(errors, [])
+        self.assertGreater(reads, 0)
+
+    def test_single_updates(self):
+        tree = ConcurrentAVLTree()
+        threads = [threading.Thread(target=lambda offset=i: [tree.insertNode(k, k) for k in range(offset, 2000, 4)])
+                   for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        tree.tree.verify_tree()
+        self.assertEqual([k for k, _ in tree.items()], list(range(2000)))
+
+
+class TestFindMany(unittest.TestCase):
+
+    def test_original_order_duplicates_and_missing(self):
+        tree = AVLTree.from_sorted((k, 'v%d' % k) for k in range(0, 2000, 2))
+        rnd = random.Random(3)
+        keys = [rnd.randrange(-10, 2010) for _ in range(500)] + [4, 4, 3, 4, -1, 1998, 1998]
+        expected = ['v%d' % k if k % 2 == 0 and 0 <= k < 2000 else None for k in keys]
+        self.assertEqual(tree.find_many(keys), expected)
+        sparse = [keys[0], keys[1], keys[0], 5]
+        self.assertEqual(tree.find_many(sparse), [tree.find_by_key(k) for k in sparse]) # find_by_key fallback
+
+    def test_both_strategies_agree(self):
+        tree = AVLTree.from_sorted((k, k) for k in range(0, 3000, 3))
+        keys = list(range(3000, -1, -7)) + [0, 0, 2999]
+        tree.FIND_MANY_SPARSE_RATIO = tree.size # always the finger search
+        finger = tree.find_many(keys)
+        tree.FIND_MANY_SPARSE_RATIO = 0 # always find_by_key
+        self.assertEqual(finger, tree.find_many(keys))
+        self.assertEqual(finger, [k if k % 3 == 0 and k < 3000 else None for k in keys])
+
+    def test_empty(self):
+        self.assertEqual(AVLTree().find_many([1, 2]), [None, None])
+        self.assertEqual(AVLTree.from_sorted([(1, 1)]).find_many([]), [])
+        with self.assertRaises(ValueError):
+            AVLTree().find_many([1, None])
+
+
+class TestSnapshotFile(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.avl')
+        os.close(fd)
+        rnd = random.Random(6)
+        self.tree = AVLTree()
+        for key in rnd.sample(range(5000), 800):
+            self.tree.insertNode(key, ('value', key, 'x' * (key % 7)))
+        self.tree.save(self.path)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_save_load_round_trip(self):
+        loaded = AVLTree.load(self.path)
+        loaded.verify_tree()
+        self.assertEqual(loaded.getSize(), self.tree.getSize())
+        self.assertEqual(list(loaded.items()), list(self.tree.items()))
+        AVLTree().save(self.path)
+        self.assertEqual(list(AVLTree.load(self.path).items()), [])
+
+    def test_mapped_lookups_and_ranges(self):
+        keys = [k for k, _ in self.tree.items()]
+        with MappedAVLTree(self.path) as mapped:
+            self.assertEqual(mapped.getSize(), len(keys))
+            for key in keys[::17] + [keys[0], keys[-1]]:
+                self.assertEqual(mapped.find_by_key(key), self.tree.find_by_key(key))
+            for key in (-1, 5000, next(k for k in range(5000) if self.tree.find_by_key(k) is None)):
+                self.assertIsNone(mapped.find_by_key(key))
+            self.assertEqual(list(mapped.items()), list(self.tree.items()))
+            for lo, hi in ((100, 900), (keys[3], keys[3]), (-10, keys[0]), (keys[-1], 10 ** 6), (900, 100)):
+                self.assertEqual(list(mapped.items(lo, hi)), list(self.tree.items(lo, hi)), (lo, hi))
+            with self.assertRaises(ValueError):
+                mapped.find_by_key(None)
+
+    def test_truncated_and_foreign_files(self):
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        for content in [data[:cut] for cut in (0, 5, 100, len(data) // 2, len(data) - 1)] + [
+                b'AVLT' + b'\x09\x00' + data[6:], # other format version
+                b'not a snapshot, just some text' * 10]:
+            with open(self.path, 'wb') as f:
+                f.write(content)
+            with self.assertRaises(ValueError):
+                AVLTree.load(self.path)
+            if content: # mmap can't map an empty file at all
+                with self.assertRaises(ValueError):
+                    MappedAVLTree(self.path)
+
+
+def check_persistent_node(test, n):
+    # recomputes height and size of the subtree, asserting AVL balance and search tree order on the way
+    if n is None:
+        return -1, 0
+    left_height, left_size = check_persistent_node(test, n.left)
+    right_height, right_size = check_persistent_node(test, n.right)
+    test.assertLessEqual(abs(left_height - right_height), 1, n.key)
+    test.assertTrue(n.left is None or n.left.key < n.key)
+    test.assertTrue(n.right is None or n.key < n.right.key)
+    test.assertEqual((n.height, n.subtree_size), (1 + max(left_height, right_height), 1 + left_size + right_size))
+    return n.height, n.subtree_size
+
+
+class TestPersistentAVLTree(unittest.TestCase):
+
+    def test_snapshots_unaffected_by_later_updates(self):
+        rnd = random.Random(5)
+        tree = PersistentAVLTree()
+        expected = {}
+        snapshots = []
+        for step in range(3000):
+            key = rnd.randrange(500)
+            if rnd.random() < 0.6:
+                self.assertEqual(tree.insertNode(key, step), key not in expected)
+                expected.setdefault(key, step)
+            else:
+                self.assertEqual(tree.removeNode(key), expected.pop(key, None) is not None)
+            if step % 100 == 0:
+                snapshots.append((tree.snapshot(), sorted(expected.items())))
+
+        branch = snapshots[5][0].snapshot() # updating a snapshot must not touch the version it came from either
+        for key in range(0, 500, 3):
+            branch.insertNode(key, -1)
+            branch.removeNode(key + 1)
+        snapshots.append((tree, sorted(expected.items())))
+
+        for snapshot, items in snapshots:
+            self.assertEqual(list(snapshot.items()), items)
+            self.assertEqual(snapshot.getSize(), len(items))
+            check_persistent_node(self, snapshot.getTreeRoot())
+        check_persistent_node(self, branch.getTreeRoot())
+
+    def test_range_and_missing_keys(self):
+        tree = PersistentAVLTree()
+        for key in range(0, 100, 5):
+            tree.insertNode(key, str(key))
+        old = tree.snapshot()
+        tree.removeNode(10)
+        self.assertEqual(list(old.items(7, 20)), [(10, '10'), (15, '15'), (20, '20')])
+        self.assertEqual(list(tree.items(7, 20)), [(15, '15'), (20, '20')])
+        self.assertEqual(old.find_by_key(10), '10')
+        self.assertIsNone(tree.find_by_key(10))
+        self.assertFalse(tree.removeNode(10))
+        self.assertFalse(tree.insertNode(15, 'other'))
+
+
+def benchmark_find_many(size=1000000):
+    # finger search vs. one find_by_key per key for batches of growing density (best of 3 runs), the crossover
+    # decides AVLTree.FIND_MANY_SPARSE_RATIO
+    tree = AVLTree.from_sorted((k, k) for k in range(size))
+    rnd = random.Random(4)
+
+    def best_of_3(run):
+        times = []
+        for _ in range(3):
+            start = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - start)
+        return min(times)
+
+    print(f"find_many on {size} keys (us/key)\nnodes per key  finger   find_by_key")
+    for ratio in (1024, 256, 128, 64, 32, 16, 8, 4, 1):
+        keys = [rnd.randrange(size) for _ in range(max(size // ratio, 200))]
+        tree.FIND_MANY_SPARSE_RATIO = size # force the finger search
+        finger = best_of_3(lambda: tree.find_many(keys)) / len(keys)
+        single = best_of_3(lambda: [tree.find_by_key(key) for key in keys]) / len(keys)
+        print(f"{ratio:<14} {finger * 1e6:<8.2f} {single * 1e6:.2f}")
+
+
+def benchmark():
+    benchmark_find_many()
+    # throughput of the writer and the readers for different numbers of reader threads
+    for readers in (0, 1, 2, 4, 8):
+        errors, reads, batches_per_second = run_stress(readers=readers, batches=300)
+        print(f"{readers} readers: {batches_per_second:.0f} batches/s, {reads} reads, errors: {len(errors)}")
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['benchmark']:
+        benchmark()
+    else:
+        unittest.main()
@@ -0,0 +1,356 @@
+import importlib.util
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from chaining_hash_node import ChainingHashNode
+
+# the module name starts with a digit, so it can't be imported with a normal import statement
+_spec = importlib.util.spec_from_file_location(
+    'chaining_hash_set', os.path.join(os.path.dirname(os.path.abspath(__file__)), '02_chaining_hash_set.py'))
+chaining_hash_set = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(chaining_hash_set)
+ChainingHashSet = chaining_hash_set.ChainingHashSet
+StripedChainingHashSet = chaining_hash_set.StripedChainingHashSet
+NumpyIntHashSet = chaining_hash_set.NumpyIntHashSet
+DiskHashSet = chaining_hash_set.DiskHashSet
+
+
+def identity(key):
+    return key
+
+
+def identity_table(keys, capacity):
+    # table like the course tests build it: key k in bucket k % capacity
+    table = [None] * capacity
+    for key in keys:
+        node = ChainingHashNode(key)
+        node.next = table[key % capacity]
+        table[key % capacity] = node
+    return table
+
+
+class TestSetHashTable(unittest.TestCase):
+
+    KEYS = (13, 82, 92, 12, 2, 32)
+
+    def test_default_constructor_uses_modulo_layout(self):
+        s = ChainingHashSet()
+        s.set_hash_table(identity_table(self.KEYS, 10))
+        for key in self.KEYS:
+            self.assertTrue(s.contains(key))
+            self.assertEqual(s.get_hash_code(key), key % 10)
+        self.assertFalse(s.contains(22))
+        self.assertTrue(s.remove(92))
+        self.assertFalse(s.contains(92))
+        self.assertEqual(s.get_table_size(), 5)
+
+    def test_to_string_of_set_table(self):
+        s = ChainingHashSet()
+        s.set_hash_table([None] * 10)
+        for key in self.KEYS:
+            self.assertTrue(s.insert(key))
+        self.assertEqual(s.to_string(), '0 {}, 1 {}, 2 {82, 92, 12, 2, 32}, 3 {13}, 4 {}, 5 {}, 6 {}, 7 {}, 8 {}, 9 {}')
+
+    def test_growing_after_set_table(self):
+        s = ChainingHashSet()
+        s.set_hash_table([None] * 4)
+        for key in range(-5, 30):
+            s.insert(key)
+        for key in range(-5, 30):
+            self.assertTrue(s.contains(key))
+        self.assertGreater(len(s.get_hash_table()), 4)
+
+
+class TestIteration(unittest.TestCase):
+
+    def test_lookups_during_pending_resize(self):
+        s = ChainingHashSet(8, rehash_step=1)
+        for key in range(9): # the 9th insert starts growing to 16 buckets
+            s.insert(key)
+        self.assertEqual(sorted(key for key in s if s.contains(key)), list(range(9)))
+
+
+class TestSetAlgebra(unittest.TestCase):
+
+    def make(self, keys, capacity):
+        s = ChainingHashSet(hash_function=identity) # same function, so both sets hash alike
+        s.set_hash_table(identity_table(keys, capacity))
+        return s
+
+    def test_copy_keeps_non_power_of_two_table(self):
+        a = self.make(range(1, 7), 10)
+        b = a.copy()
+        self.assertEqual(len(b.get_hash_table()), 10)
+        for key in range(1, 7):
+            self.assertTrue(b.contains(key))
+        self.assertFalse(b.contains(7))
+
+    def test_algebra_with_non_power_of_two_table(self):
+        a = self.make(range(11, 17), 10)
+        b = self.make(range(14, 20), 10)
+        self.assertEqual(sorted(a.intersection(b)), [14, 15, 16])
+        self.assertEqual(sorted(a.difference(b)), [11, 12, 13])
+        self.assertEqual(sorted(a.union(b)), list(range(11, 20)))
+        for key in range(10, 21):
+            self.assertEqual(a.intersection(b).contains(key), 14 <= key <= 16)
+            self.assertEqual(a.difference(b).contains(key), 11 <= key <= 13)
+            self.assertEqual(a.union(b).contains(key), 11 <= key <= 19)
+
+
+def striped_worker(s, thread_id, operations):
+    # every thread owns its own key range, so it knows the expected results; all threads also insert shared keys
+    rnd = random.Random(thread_id)
+    own = set()
+    wrong = 0
+    for _ in range(operations):
+        key = thread_id * 1000000 + rnd.randrange(2000)
+        op = rnd.random()
+        if op < 0.5:
+            wrong += s.insert(key) != (key not in own)
+            own.add(key)
+        elif op < 0.8:
+            wrong += s.contains(key) != (key in own)
+        else:
+            wrong += s.remove(key) != (key in own)
+            own.discard(key)
+        s.insert(-rnd.randint(1, 200))
+    return wrong, own
+
+
+class GrowOnAcquire:
+    """Lock wrapper that grows the set right before the first acquire after arming, like another thread
+    finishing a resize between _lock_bucket reading the table and getting the stripe lock."""
+
+    def __init__(self, s, lock, state):
+        self.s, self.lock, self.state = s, lock, state
+
+    def acquire(self):
+        if self.state['armed']:
+            self.state['armed'] = False
+            self.s._grow(len(self.s.hash_table))
+        self.state['acquires'] += 1
+        return self.lock.acquire()
+
+    def release(self):
+        self.lock.release()
+
+
+class TestStripedChainingHashSet(unittest.TestCase):
+
+    def test_thread_pool_stress(self):
+        s = StripedChainingHashSet(stripes=8) # starts small, so it grows many times while the threads run
+        with ThreadPoolExecutor(8) as pool:
+            results = list(pool.map(lambda thread_id: striped_worker(s, thread_id, 5000), range(8)))
+        self.assertEqual(sum(wrong for wrong, _ in results), 0)
+        expected = set(range(-200, 0)).union(*(own for _, own in results))
+        self.assertEqual(sorted(s), sorted(expected))
+        self.assertEqual(s.get_table_size(), len(expected))
+        self.assertGreater(len(s.hash_table), 8)
+
+    def test_retry_on_replaced_table(self):
+        s = StripedChainingHashSet(capacity=8, stripes=4)
+        for key in range(8):
+            s.insert(key)
+        capacity = len(s.hash_table)
+        state = {'armed': True, 'acquires': 0}
+        s.locks = [GrowOnAcquire(s, lock, state) for lock in s.locks]
+        self.assertTrue(s.insert(100))
+        self.assertEqual(len(s.hash_table), 2 * capacity)
+        self.assertEqual(state['acquires'], 4 + 2) # all locks for the grow, then the stale and the retried stripe
+        for key in list(range(8)) + [100]:
+            self.assertTrue(s.contains(key))
+        self.assertEqual(s.get_table_size(), 9)
+
+    def test_concurrent_grow_only_once(self):
+        s = StripedChainingHashSet(capacity=8, stripes=4)
+        threads = [threading.Thread(target=s._grow, args=(8,)) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(s.hash_table), 16)
+
+
+class TestDiskHashSet(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'keys.set')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_random_operations_and_reopen(self):
+        rnd = random.Random(9)
+        expected = set()
+        d = DiskHashSet(self.path, capacity=4)
+        for step in range(6000):
+            key = rnd.choice([rnd.randint(-10 ** 12, 10 ** 12), 's%d' % rnd.randrange(1000),
+                              b'b%d' % rnd.randrange(1000), rnd.randrange(1000)])
+            op = rnd.random()
+            if op < 0.5:
+                self.assertEqual(d.insert(key), key not in expected)
+                expected.add(key)
+            elif op < 0.7:
+                self.assertEqual(d.contains(key), key in expected)
+            else:
+                self.assertEqual(d.remove(key), key in expected)
+                expected.discard(key)
+            if step == 3000: # reopen in the middle, everything has to come back from the file
+                d.close()
+                d = DiskHashSet(self.path)
+        self.assertEqual(d.get_table_size(), len(expected))
+        self.assertEqual(set(d), expected)
+        d.close()
+        with DiskHashSet(self.path) as d:
+            self.assertEqual(set(d), expected)
+            self.assertEqual(d.get_table_size(), len(expected))
+
+    def test_buckets_grow_with_the_keys(self):
+        with DiskHashSet(self.path, capacity=4) as d:
+            for key in range(5000):
+                d.insert(key)
+            self.assertGreaterEqual(d.bucket_count, 5000) # split one bucket at a time, load factor <= 1
+            longest = 0
+            for i in range(d.bucket_count):
+                length, current = 0, d.BUCKET.unpack_from(d.map, d._bucket_at(i))[0]
+                while current:
+                    length += 1
+                    current = d.RECORD_HEAD.unpack_from(d.map, current)[0]
+                longest = max(longest, length)
+            self.assertLess(longest, 16)
+            bucket_count = d.bucket_count
+        with DiskHashSet(self.path) as d:
+            self.assertEqual(d.bucket_count, bucket_count)
+            self.assertTrue(all(d.contains(key) for key in range(5000)))
+
+    def test_free_list_reuses_records(self):
+        with DiskHashSet(self.path) as d:
+            for key in range(100):
+                d.insert(key)
+            end = d._header()[7]
+            for key in range(50):
+                d.remove(key)
+            for key in range(1000, 1050):
+                d.insert(key)
+            self.assertEqual(d._header()[7], end) # no new space, removed records were reused
+            self.assertEqual(set(d), set(range(50, 100)) | set(range(1000, 1050)))
+
+    def test_clear(self):
+        with DiskHashSet(self.path, capacity=4) as d:
+            for key in range(1000):
+                d.insert(key)
+            d.clear()
+            self.assertEqual(d.get_table_size(), 0)
+            self.assertEqual(list(d), [])
+            self.assertEqual(d.bucket_count, 4)
+            self.assertEqual(os.path.getsize(self.path), d.records_start)
+            self.assertFalse(d.contains(5))
+            self.assertTrue(d.insert(5))
+            self.assertTrue(d.contains(5))
+
+    def test_invalid_keys(self):
+        with DiskHashSet(self.path, key_size=8) as d:
+            with self.assertRaises(ValueError):
+                d.insert('x' * 100)
+            with self.assertRaises(TypeError):
+                d.insert(1.5)
+            with self.assertRaises(ValueError):
+                d.insert(None)
+
+    def test_foreign_and_truncated_files(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'zz')
+        with self.assertRaises(ValueError):
+            DiskHashSet(self.path)
+        with open(self.path, 'wb') as f:
+            f.write(b'X' * 4096)
+        with self.assertRaises(ValueError):
+            DiskHashSet(self.path)
+        os.remove(self.path)
+        with DiskHashSet(self.path) as d:
+            for key in range(200):
+                d.insert(key)
+            size = d._header()[7]
+        with open(self.path, 'r+b') as f:
+            f.truncate(size // 2)
+        with self.assertRaises(ValueError):
+            DiskHashSet(self.path)
+
+
+@unittest.skipIf(chaining_hash_set.np is None, "needs numpy")
+class TestNumpyIntHashSet(unittest.TestCase):
+
+    def test_rejects_non_integer_keys(self):
+        s = NumpyIntHashSet()
+        with self.assertRaises(TypeError):
+            s.insert(3.7)
+        with self.assertRaises(TypeError):
+            s.contains(3.7)
+        with self.assertRaises(TypeError):
+            s.remove(3.7)
+        with self.assertRaises(TypeError):
+            s.insert_many([1.5, 2.0])
+        with self.assertRaises(TypeError):
+            s.contains_many(chaining_hash_set.np.array([1.0]))
+        self.assertEqual(s.get_table_size(), 0)
+        self.assertFalse(s.contains(3))
+
+    def test_integer_keys(self):
+        np = chaining_hash_set.np
+        s = NumpyIntHashSet()
+        self.assertTrue(s.insert(3))
+        self.assertTrue(s.insert(np.int32(4)))
+        self.assertEqual(list(s.insert_many(np.array([4, 5, 5], dtype=np.uint16))), [False, True, False])
+        self.assertEqual(list(s.contains_many([3, 4, 5, 6])), [True, True, True, False])
+        self.assertEqual(list(s.remove_many([])), [])
+        self.assertTrue(s.remove(3))
+
+
+class GlobalLockHashSet:
+    # baseline for the benchmark: ChainingHashSet behind one lock
+    def __init__(self):
+        self.s = ChainingHashSet()
+        self.lock = threading.Lock()
+
+    def insert(self, key):
+        with self.lock:
+            return self.s.insert(key)
+
+    def contains(self, key):
+        with self.lock:
+            return self.s.contains(key)
+
+
+def benchmark(operations=40000):
+    # 1 insert per 3 lookups on random keys, ops/s of StripedChainingHashSet vs. one global lock
+    def run(s, threads):
+        def work(thread_id):
+            rnd = random.Random(thread_id)
+            for i in range(operations):
+                key = rnd.randrange(100000)
+                if i % 4 == 0:
+                    s.insert(key)
+                else:
+                    s.contains(key)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(threads) as pool:
+            list(pool.map(work, range(threads)))
+        return threads * operations / (time.perf_counter() - start)
+
+    for threads in (1, 2, 4, 8):
+        print(f"{threads} threads: striped {run(StripedChainingHashSet(), threads):.0f} ops/s, "
+              f"global lock {run(GlobalLockHashSet(), threads):.0f} ops/s")
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['benchmark']:
+        benchmark()
+    else:
+        unittest.main()
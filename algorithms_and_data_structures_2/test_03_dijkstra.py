@@ -0,0 +1,311 @@
+import hashlib
+import importlib.util
+import os
+import random
+import sys
+import tempfile
+import time
+import unittest
+
+# the module name starts with a digit, so it can't be imported with a normal import statement
+_spec = importlib.util.spec_from_file_location(
+    'dijkstra', os.path.join(os.path.dirname(os.path.abspath(__file__)), '03_dijkstra.py'))
+dijkstra = importlib.util.module_from_spec(_spec)
+sys.modules[_spec.name] = dijkstra # distance_matrix workers get their functions pickled by module name
+_spec.loader.exec_module(dijkstra)
+JKUMap = dijkstra.JKUMap
+ContractionHierarchy = dijkstra.ContractionHierarchy
+
+
+def path_of(path):
+    return [(step.point.name, step.covered_distance) for step in path]
+
+
+def random_map(seed, cls=JKUMap, **options):
+    """JKUMap plus up to 14 random nodes with small integer weights (lots of equally long paths),
+    sometimes linked to the campus nodes.
+    :return (map, names of the random nodes)
+    """
+    rnd = random.Random(seed)
+    m = cls(**options)
+    names = ['n%d' % i for i in range(rnd.randint(2, 14))]
+    for name in names:
+        m.add(name)
+    for _ in range(rnd.randint(0, 3 * len(names))):
+        m.add_edge(rnd.choice(names), rnd.choice(names), rnd.choice((1, 2, 3)))
+    if rnd.random() < 0.5:
+        m.add_edge(names[0], rnd.choice((cls.SPAR, cls.LIT, cls.KHG, cls.JKH)), rnd.choice((1, 2, 3)))
+    return m, names
+
+
+def tie_output(m, names):
+    # every path get_shortest_path picks and everything dijkstra() fills in, for the random nodes
+    lines = []
+    for a in names:
+        start = m.find(a)
+        for b in names:
+            if a != b:
+                path = m.get_shortest_path(start, m.find(b))
+                lines.append((a, b, None if path is None else path_of(path)))
+        visited, distances, paths = [], {}, {}
+        m.init_shortest_path_structures(start, distances, paths)
+        distances, paths = m.dijkstra(start, visited, distances, paths)
+        lines.append((a, [node.name for node in visited], sorted((node.name, d) for node, d in distances.items()),
+                      sorted((node.name, path_of(path)) for node, path in paths.items())))
+    return lines
+
+
+def tie_digest(seeds=range(300), cls=JKUMap):
+    digest = hashlib.sha256()
+    for seed in seeds:
+        digest.update(repr(tie_output(*random_map(seed, cls))).encode())
+    return digest.hexdigest()
+
+
+# tie_digest() of the original implementation, which re-sorted the whole queue every round; which of several
+# equally long paths is returned has to stay the same
+ORIGINAL_TIE_DIGEST = '6346134bf429bc13387c8aea3172a7101002e9aabe3cb224805ac5acf3665324'
+
+
+class TestDijkstra(unittest.TestCase):
+
+    def test_ties_resolved_like_the_original(self):
+        self.assertEqual(tie_digest(), ORIGINAL_TIE_DIGEST)
+
+    def test_small_tie_graph(self):
+        m = JKUMap()
+        for name in 'abcd':
+            m.add(name)
+        m.add_edge('a', 'b', 1)
+        m.add_edge('a', 'c', 1)
+        m.add_edge('b', 'd', 1)
+        m.add_edge('c', 'd', 1)
+        self.assertEqual(path_of(m.get_shortest_path(m.find('a'), m.find('d'))), [('a', 0), ('b', 1), ('d', 2)])
+        self.assertEqual(path_of(m.get_shortest_path(m.find('d'), m.find('a'))), [('d', 0), ('b', 1), ('a', 2)])
+
+
+class TestTreeCache(unittest.TestCase):
+
+    def test_off_by_default(self):
+        m = JKUMap()
+        m.get_shortest_distances(m.find(JKUMap.SPAR))
+        self.assertEqual(m.get_cache_stats()['size'], 0)
+
+    def test_miss_uses_early_exit(self):
+        m = JKUMap(cache_size=4)
+        path = m.get_shortest_path(m.find(JKUMap.SPAR), m.find(JKUMap.LIT)) # LIT is settled early, tree incomplete
+        self.assertEqual(path_of(path), [(JKUMap.SPAR, 0), (JKUMap.LIT, 50)])
+        self.assertEqual(m.get_cache_stats()['size'], 0)
+        distances = m.get_shortest_distances(m.find(JKUMap.SPAR)) # full search, cached
+        self.assertEqual(m.get_cache_stats()['size'], 1)
+        path = m.get_shortest_path(m.find(JKUMap.SPAR), m.find(JKUMap.TEICHWERK))
+        self.assertEqual(path[-1].covered_distance, distances[JKUMap.TEICHWERK])
+        self.assertEqual(m.get_cache_stats()['hits'], 1)
+
+    def test_repaired_trees_match_uncached_map(self):
+        for seed in range(40):
+            rnd = random.Random(seed)
+            cached, plain = JKUMap(cache_size=8), JKUMap()
+            names = [node.name for node in plain.get_nodes()]
+            for step in range(60):
+                op = rnd.random()
+                if op < 0.15: # new node, linked to the graph half of the time
+                    name = 'n%d' % step
+                    names.append(name)
+                    updates = [('add', name)]
+                    if rnd.random() < 0.5:
+                        updates.append(('add_edge', name, rnd.choice(names[:-1]), rnd.randint(1, 200)))
+                elif op < 0.45:
+                    updates = [('add_edge', rnd.choice(names), rnd.choice(names), rnd.randint(1, 200))]
+                else:
+                    edge = rnd.choice(plain.get_edges())
+                    factor = rnd.choice((0.3, 0.5, 0.9, 1.5, 3)) # decreases are repaired, increases drop the cache
+                    updates = [('update_edge_weight', edge.first.name, edge.second.name, int(edge.weight * factor) + 1)]
+                for update in updates:
+                    for m in (cached, plain):
+                        getattr(m, update[0])(*update[1:])
+                for name in rnd.sample(names, 3): # fills the cache, later updates have to repair these trees
+                    self.assertEqual(cached.get_shortest_distances(cached.find(name)),
+                                     plain.get_shortest_distances(plain.find(name)), (seed, step, name))
+                a, b = rnd.sample(names, 2)
+                path, expected = cached.get_shortest_path(cached.find(a), cached.find(b)), \
+                    plain.get_shortest_path(plain.find(a), plain.find(b))
+                self.assertEqual(path is None, expected is None, (seed, step, a, b))
+                if path is not None:
+                    self.assertEqual(path[-1].covered_distance, expected[-1].covered_distance, (seed, step, a, b))
+                    for prev, point in zip(path, path[1:]): # repaired predecessors still form real paths
+                        edge = cached.find_edge(prev.point.name, point.point.name)
+                        self.assertEqual(point.covered_distance - prev.covered_distance, edge.weight)
+            self.assertGreater(cached.get_cache_stats()['hits'], 0)
+
+    def test_repair_keeps_trees_and_increase_drops_them(self):
+        m = JKUMap(cache_size=4)
+        m.get_shortest_distances(m.find(JKUMap.SPAR))
+        m.update_edge_weight(JKUMap.SPAR, JKUMap.LIT, 10) # decrease, repaired in place
+        m.add_edge(JKUMap.JKH, JKUMap.SPAR, 20)
+        self.assertEqual(m.get_cache_stats()['size'], 1)
+        self.assertEqual(m.get_shortest_distances(m.find(JKUMap.SPAR))[JKUMap.JKH], 20)
+        self.assertEqual(m.get_cache_stats()['hits'], 1)
+        m.update_edge_weight(JKUMap.JKH, JKUMap.SPAR, 500) # increase, the tree can't be repaired
+        self.assertEqual(m.get_cache_stats()['size'], 0)
+        plain = JKUMap()
+        plain.update_edge_weight(JKUMap.SPAR, JKUMap.LIT, 10)
+        plain.add_edge(JKUMap.JKH, JKUMap.SPAR, 500)
+        self.assertEqual(m.get_shortest_distances(m.find(JKUMap.SPAR)),
+                         plain.get_shortest_distances(plain.find(JKUMap.SPAR)))
+        self.assertEqual(m.get_cache_stats()['misses'], 2)
+
+
+@unittest.skipIf(dijkstra.np is None, "distance_matrix requires numpy")
+class TestDistanceMatrix(unittest.TestCase):
+
+    def setUp(self):
+        # campus plus random nodes, some of them in other components, and a node without any edge
+        self.map, _ = random_map(7)
+        self.map.add('isolated')
+        self.nodes = self.map.get_nodes()
+
+    def expected_row(self, source, targets):
+        distances = self.map.get_shortest_distances(source)
+        return [float('inf') if distances[node.name] == -1 else distances[node.name] for node in targets]
+
+    def test_workers_agree_with_dijkstra(self):
+        single = self.map.distance_matrix(self.nodes, workers=1)
+        parallel = self.map.distance_matrix(self.nodes, workers=2)
+        self.assertEqual(parallel.shape, (len(self.nodes), len(self.nodes)))
+        self.assertTrue(dijkstra.np.array_equal(single, parallel))
+        for row, source in zip(parallel.tolist(), self.nodes):
+            self.assertEqual(row, self.expected_row(source, self.nodes), source.name)
+        isolated = self.nodes.index(self.map.find('isolated'))
+        self.assertEqual(parallel[isolated, isolated], 0)
+        self.assertEqual(sum(parallel[isolated] == float('inf')), len(self.nodes) - 1)
+
+    def test_subset_of_targets(self):
+        rnd = random.Random(1)
+        sources = rnd.sample(self.nodes, 9)
+        targets = rnd.sample(self.nodes, 5) + [self.map.find('isolated'), self.map.find(JKUMap.SPAR)]
+        single = self.map.distance_matrix(sources, targets, workers=1)
+        parallel = self.map.distance_matrix(sources, targets, workers=2)
+        self.assertEqual(parallel.shape, (len(sources), len(targets)))
+        self.assertTrue(dijkstra.np.array_equal(single, parallel))
+        for row, source in zip(parallel.tolist(), sources):
+            self.assertEqual(row, self.expected_row(source, targets), source.name)
+
+
+class TestContractionHierarchy(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.ch')
+        os.close(fd)
+        JKUMap().build_contraction_hierarchy().save(self.path)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_loaded_hierarchy_on_same_graph(self):
+        m = JKUMap()
+        m.set_contraction_hierarchy(ContractionHierarchy.load(self.path))
+        plain = JKUMap(cache_size=0)
+        for a, b in ((JKUMap.JKH, JKUMap.CASTLE), (JKUMap.SPAR, JKUMap.TEICHWERK), (JKUMap.SP3, JKUMap.OPEN_LAB)):
+            self.assertEqual(path_of(m.get_shortest_path(m.find(a), m.find(b)))[-1],
+                             path_of(plain.get_shortest_path(plain.find(a), plain.find(b)))[-1])
+
+    def test_rejects_other_weights_and_edges(self):
+        hierarchy = ContractionHierarchy.load(self.path)
+        fingerprint = hierarchy.fingerprint
+        reweighted = JKUMap()
+        reweighted.update_edge_weight(JKUMap.SPAR, JKUMap.LIT, 5)
+        with self.assertRaises(ValueError):
+            reweighted.set_contraction_hierarchy(hierarchy)
+        extended = JKUMap()
+        extended.add_edge(JKUMap.JKH, JKUMap.SPAR, 10)
+        with self.assertRaises(ValueError):
+            extended.set_contraction_hierarchy(hierarchy)
+        self.assertIsNone(extended.hierarchy)
+        self.assertEqual(hierarchy.fingerprint, fingerprint) # the caller's object is left alone
+
+    def test_random_graphs_against_dijkstra(self):
+        for seed in range(150):
+            m, names = random_map(seed)
+            plain = JKUMap()
+            for e in m.get_edges(): # same graph, answered by plain Dijkstra
+                plain.add(e.first.name)
+                plain.add(e.second.name)
+                plain.add_edge(e.first.name, e.second.name, e.weight)
+            m.build_contraction_hierarchy()
+            for a in names + [JKUMap.SPAR]:
+                for b in names + [JKUMap.JKH]:
+                    if a == b or plain.find(a) is None or plain.find(b) is None:
+                        continue
+                    path = m.get_shortest_path(m.find(a), m.find(b))
+                    expected = plain.get_shortest_path(plain.find(a), plain.find(b))
+                    self.assertEqual(path is None, expected is None, (seed, a, b))
+                    if path is None:
+                        continue
+                    self.assertEqual(path[-1].covered_distance, expected[-1].covered_distance, (seed, a, b))
+                    self.assertEqual((path[0].point.name, path[-1].point.name), (a, b))
+                    for prev, step in zip(path, path[1:]): # shortcuts unpacked into real edges
+                        edge = m.find_edge(prev.point.name, step.point.name)
+                        self.assertEqual(step.covered_distance - prev.covered_distance, edge.weight)
+
+    def test_stale_after_graph_change(self):
+        m = JKUMap()
+        m.build_contraction_hierarchy()
+        m.add_edge(JKUMap.JKH, JKUMap.SPAR, 1) # the hierarchy doesn't know this edge, plain Dijkstra must be used
+        path = m.get_shortest_path(m.find(JKUMap.JKH), m.find(JKUMap.SPAR))
+        self.assertEqual(path_of(path), [(JKUMap.JKH, 0), (JKUMap.SPAR, 1)])
+
+
+def grid_map(side, seed=0):
+    # side x side grid with random weights, roughly like a road network
+    rnd = random.Random(seed)
+    m = JKUMap()
+    for i in range(side * side):
+        m.add(i)
+    for x in range(side):
+        for y in range(side):
+            if x + 1 < side:
+                m.add_edge(x * side + y, (x + 1) * side + y, rnd.randint(10, 30))
+            if y + 1 < side:
+                m.add_edge(x * side + y, x * side + y + 1, rnd.randint(10, 30))
+    return m
+
+
+def benchmark():
+    # single source shortest paths on growing grids, the time per edge should only grow like log(n)
+    print("nodes     edges     ms/search  us/edge")
+    for side in (25, 50, 100, 200):
+        m = grid_map(side)
+        sources = [m.find(i) for i in random.Random(1).sample(range(side * side), 5)]
+        start = time.perf_counter()
+        for source in sources:
+            m.get_shortest_distances(source)
+        elapsed = (time.perf_counter() - start) / len(sources)
+        print(f"{m.get_number_of_nodes():<9} {m.get_number_of_edges():<9} {elapsed * 1e3:<10.1f} "
+              f"{elapsed * 1e6 / m.get_number_of_edges():.2f}")
+
+    # contraction hierarchy: preprocessing once vs. point-to-point query latency of get_shortest_path
+    print("\nnodes     preprocessing  shortcuts  dijkstra ms/query  CH ms/query")
+    for side in (25, 50, 100):
+        m = grid_map(side)
+        rnd = random.Random(2)
+        pairs = [(m.find(a), m.find(b)) for a, b in (rnd.sample(range(side * side), 2) for _ in range(100))]
+        start = time.perf_counter()
+        expected = [m.get_shortest_path(a, b)[-1].covered_distance for a, b in pairs]
+        dijkstra_time = (time.perf_counter() - start) / len(pairs)
+        start = time.perf_counter()
+        hierarchy = m.build_contraction_hierarchy()
+        preprocessing = time.perf_counter() - start
+        start = time.perf_counter()
+        result = [m.get_shortest_path(a, b)[-1].covered_distance for a, b in pairs]
+        ch_time = (time.perf_counter() - start) / len(pairs)
+        assert result == expected
+        print(f"{m.get_number_of_nodes():<9} {preprocessing:<14.1f} {hierarchy.n_shortcuts:<10} "
+              f"{dijkstra_time * 1e3:<18.2f} {ch_time * 1e3:.3f}")
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['benchmark']:
+        benchmark()
+    else:
+        unittest.main()